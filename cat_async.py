@@ -0,0 +1,313 @@
+"""
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+import xmlrpc.client
+
+logger = logging.getLogger("cat_async")
+
+# Default seconds to wait for any single command
+DEFAULT_COMMAND_TIMEOUT = 2.0
+
+# Errors that mean we lost (or never had) the rig. A short read is
+# asyncio.IncompleteReadError (an EOFError). Timeouts are asyncio.TimeoutError,
+# which is only the built-in TimeoutError (an OSError) from Python 3.11 on.
+RIG_ERRORS = (OSError, EOFError, ValueError, asyncio.TimeoutError, xmlrpc.client.Fault,
+              xmlrpc.client.ProtocolError)
+
+
+class AsyncCAT:
+    """asyncio CAT control for rigctld or flrig"""
+
+    def __init__(self, interface: str, host: str, port: int,
+                 timeout: float = DEFAULT_COMMAND_TIMEOUT) -> None:
+        """
+        The asyncio counterpart to cat_interface.CAT, with the same method
+        surface: get_vfo(), get_mode(), get_power(), get_strength(), get_ptt(),
+        set_vfo(), set_mode(), ptt_on() and ptt_off(), all of them coroutines.
+
+        Takes the same interface ('rigctld', 'flrig' or 'fake'), host and port
+        as CAT, plus a default per-command timeout in seconds. Every method
+        also takes a timeout keyword to override it for one call.
+
+        Nothing touches the network until connect() is awaited. Like CAT, the
+        'online' attribute is True if the last command succeeded.
+
+        Commands are serialized on one connection. If a command times out or
+        the awaiting task is cancelled while it is in flight, the connection is
+        closed so a late reply can't be mistaken for the answer to the next
+        command; the next call reconnects.
+        """
+        self.interface = interface.lower()
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.online = False
+        self.fake_radio = {
+            "vfo": "14032000",
+            "mode": "CW",
+            "power": "100",
+            "ptt": False,
+            "strength": -54,
+            "signals": {},
+        }
+        self.__reader = None
+        self.__writer = None
+        self.__lock = asyncio.Lock()
+
+    async def connect(self, timeout: float = None) -> bool:
+        """Opens the connection to the rig. Returns (and sets) 'online'."""
+        if self.interface == "fake":
+            self.online = True
+        elif self.interface == "rigctld":
+            self.online = await self.__guarded("connect", self.__noop, timeout, False) is not False
+        elif self.interface == "flrig":
+            self.online = await self.__flrig_call("main.get_version", timeout=timeout) is not None
+        return self.online
+
+    async def close(self) -> None:
+        """Closes the connection to the rig"""
+        async with self.__lock:
+            await self.__close_connection()
+
+    async def __noop(self) -> bool:
+        return True
+
+    async def __close_connection(self) -> None:
+        writer, self.__reader, self.__writer = self.__writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, asyncio.CancelledError):
+                ...
+
+    async def __guarded(self, name: str, exchange, timeout: float, failed):
+        """
+        Runs one request/response exchange on the shared connection, opening it
+        first if needed. exchange is a function returning the coroutine that
+        does it, which is only made once we have the connection to ourselves.
+        Returns 'failed' (and clears 'online') on rig errors. The timeout
+        covers waiting for the connection, connecting and the exchange.
+        """
+        timeout = self.timeout if timeout is None else timeout
+
+        async def locked_exchange():
+            async with self.__lock:
+                try:
+                    if self.__writer is None:
+                        self.__reader, self.__writer = await asyncio.open_connection(
+                            self.host, self.port)
+                    return await exchange()
+                except BaseException:
+                    # Timed out, cancelled or broken: the reply may still
+                    # arrive, so don't leave it for the next command
+                    await self.__close_connection()
+                    raise
+
+        try:
+            result = await asyncio.wait_for(locked_exchange(), timeout)
+        except RIG_ERRORS as exception:
+            self.online = False
+            logger.debug("%s: %s", name, f"{exception}")
+            return failed
+        self.online = True
+        return result
+
+    # rigctld
+
+    async def __rigctld_exchange(self, command: str) -> str:
+        """Sends one extended response command and reads up to its RPRT record"""
+        self.__writer.write(bytes(f"{command}\n", "utf-8"))
+        await self.__writer.drain()
+        lines = []
+        while True:
+            line = (await self.__reader.readuntil(b"\n")).decode(errors="replace").rstrip("\n")
+            lines.append(line)
+            if line.rsplit("|", 1)[-1].startswith("RPRT "):
+                return "\n".join(lines)
+
+    async def __rigctld_command(self, command: str, timeout: float):
+        return await self.__guarded(command, lambda: self.__rigctld_exchange(command), timeout, None)
+
+    @staticmethod
+    def __rigctld_result(report) -> int:
+        """Returns the RPRT code at the end of an extended rigctld reply"""
+        try:
+            return int(report.rsplit("RPRT ", 1)[1])
+        except (AttributeError, IndexError, ValueError):
+            return -1
+
+    async def __rigctld_field(self, command: str, field: int, timeout: float) -> str:
+        """Runs a get command and returns the value of one '|' separated field"""
+        report = await self.__rigctld_command(command, timeout)
+        if report is None or self.__rigctld_result(report) != 0:
+            return ""
+        try:
+            return report.split("|")[field].split(" ")[-1]
+        except IndexError as exception:
+            logger.debug("%s", f"{exception}")
+        return ""
+
+    # flrig
+
+    async def __flrig_exchange(self, method: str, params: tuple):
+        """One XML-RPC call over a keep-alive HTTP/1.1 connection"""
+        body = xmlrpc.client.dumps(params, method).encode("utf-8")
+        self.__writer.write(
+            b"POST /RPC2 HTTP/1.1\r\n"
+            + bytes(f"Host: {self.host}:{self.port}\r\n", "ascii")
+            + b"Content-Type: text/xml\r\n"
+            + bytes(f"Content-Length: {len(body)}\r\n\r\n", "ascii")
+            + body
+        )
+        await self.__writer.drain()
+
+        status = (await self.__reader.readuntil(b"\r\n")).decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = (await self.__reader.readuntil(b"\r\n")).decode("latin-1").strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        payload = await self.__reader.readexactly(int(headers.get("content-length", "0")))
+        if len(status) < 2 or status[1] != "200":
+            raise xmlrpc.client.ProtocolError(
+                f"{self.host}:{self.port}", int(status[1]) if len(status) > 1 else 0,
+                status[-1].strip(), headers)
+        connection = headers.get("connection", "").lower()
+        if connection == "close" or (status[0] == "HTTP/1.0" and connection != "keep-alive"):
+            await self.__close_connection()
+        # Raises xmlrpc.client.Fault if flrig returned one. Calls with no return
+        # value give "" so they can be told apart from a failure (None).
+        result, _ = xmlrpc.client.loads(payload)
+        return result[0] if result else ""
+
+    async def __flrig_call(self, method: str, *params, timeout: float = None):
+        return await self.__guarded(method, lambda: self.__flrig_exchange(method, params),
+                                   timeout, None)
+
+    # Public interface
+
+    async def get_vfo(self, timeout: float = None) -> str:
+        """Poll the radio for current vfo"""
+        if self.interface == "flrig":
+            vfo = await self.__flrig_call("rig.get_vfo", timeout=timeout)
+            return "" if vfo is None else str(vfo)
+        if self.interface == "rigctld":
+            # get_freq:|Frequency: 14074000|RPRT 0
+            return await self.__rigctld_field("|f", 1, timeout)
+        return self.fake_radio.get("vfo", "")
+
+    async def get_mode(self, timeout: float = None) -> str:
+        """Returns the current mode of the radio"""
+        if self.interface == "flrig":
+            mode = await self.__flrig_call("rig.get_mode", timeout=timeout)
+            return "" if mode is None else mode
+        if self.interface == "rigctld":
+            # get_mode:|Mode: CW|Passband: 500|RPRT 0
+            return await self.__rigctld_field("|m", 1, timeout)
+        return self.fake_radio.get("mode", "")
+
+    async def get_power(self, timeout: float = None):
+        """Get power level from rig"""
+        if self.interface == "flrig":
+            power = await self.__flrig_call("rig.get_power", timeout=timeout)
+            return "" if power is None else power
+        if self.interface == "rigctld":
+            # get_level: RFPOWER|0.000000|RPRT 0
+            level = await self.__rigctld_field("|l RFPOWER", 1, timeout)
+            try:
+                return int(float(level) * 100)
+            except ValueError:
+                return ""
+        return self.fake_radio.get("power", "100")
+
+    async def get_strength(self, timeout: float = None):
+        """S-meter reading in dB relative to S9, or None"""
+        if self.interface == "flrig":
+            meter = await self.__flrig_call("rig.get_smeter", timeout=timeout)
+            try:
+                meter = float(meter)
+            except (TypeError, ValueError):
+                return None
+            # flrig's meter runs from 0 to 100, with S9 at 50 and S9+60 at the top
+            return round((meter - 50) * (54 if meter <= 50 else 60) / 50)
+        if self.interface == "rigctld":
+            # get_level: STRENGTH|-54|RPRT 0
+            level = await self.__rigctld_field("|l STRENGTH", 1, timeout)
+            try:
+                return int(float(level))
+            except ValueError:
+                return None
+        return self.fake_radio["signals"].get(self.fake_radio["vfo"], self.fake_radio["strength"])
+
+    async def get_ptt(self, timeout: float = None):
+        """Get PTT state"""
+        if self.interface == "flrig":
+            ptt = await self.__flrig_call("rig.get_ptt", timeout=timeout)
+            return "0" if ptt is None else ptt
+        if self.interface == "rigctld":
+            # get_ptt:|PTT: 0|RPRT 0
+            return await self.__rigctld_field("|t", 1, timeout) or "0"
+        return self.fake_radio["ptt"]
+
+    async def set_vfo(self, freq: str, timeout: float = None) -> bool:
+        """Sets the radios vfo"""
+        if self.interface == "flrig":
+            try:
+                result = await self.__flrig_call("rig.set_frequency", float(freq), timeout=timeout)
+                return result is not None
+            except ValueError:
+                return False
+        if self.interface == "rigctld":
+            report = await self.__rigctld_command(f"|F {freq}", timeout)
+            return self.__rigctld_result(report) == 0
+        self.fake_radio["vfo"] = str(freq)
+        return True
+
+    async def set_mode(self, mode: str, timeout: float = None) -> bool:
+        """Sets the radios mode"""
+        if self.interface == "flrig":
+            return await self.__flrig_call("rig.set_mode", mode, timeout=timeout) is not None
+        if self.interface == "rigctld":
+            # A passband of 0 keeps the rig's default filter for the mode
+            report = await self.__rigctld_command(f"|M {mode} 0", timeout)
+            return self.__rigctld_result(report) == 0
+        self.fake_radio["mode"] = mode
+        return True
+
+    async def __set_ptt(self, ptt: bool, timeout: float) -> bool:
+        if self.interface == "flrig":
+            return await self.__flrig_call("rig.set_ptt", int(ptt), timeout=timeout) is not None
+        if self.interface == "rigctld":
+            report = await self.__rigctld_command(f"|T {int(ptt)}", timeout)
+            return self.__rigctld_result(report) == 0
+        self.fake_radio["ptt"] = ptt
+        return True
+
+    async def ptt_on(self, timeout: float = None) -> bool:
+        """turn ptt on"""
+        return await self.__set_ptt(True, timeout)
+
+    async def ptt_off(self, timeout: float = None) -> bool:
+        """turn ptt off"""
+        return await self.__set_ptt(False, timeout)
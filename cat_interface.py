@@ -18,8 +18,11 @@ Enable send
 curl -d "<?xml version='1.0'?><methodCall><methodName>rig.cwio_send</methodName><params><param><value><i4>1</i4></value></param></params></methodCall>" http://localhost:12345
 """
 
+import collections
 import logging
 import socket
+import threading
+import time
 import xmlrpc.client
 import http
 
@@ -28,6 +31,34 @@ if __name__ == "__main__":
 
 logger = logging.getLogger("cat_interface")
 
+# Seconds to wait for rigctld to accept a connection
+RIGCTLD_CONNECT_TIMEOUT = 0.5
+# Seconds to wait for the RPRT that ends a reply. Generous, since some rigs are
+# slow to acknowledge a frequency change; a healthy rigctld answers in a few ms.
+RIGCTLD_REPLY_TIMEOUT = 2.0
+# Seconds we trust the shadow copy of the rig state. The operator can turn the
+# knob at any time, so after this a write goes out even if it looks redundant.
+SHADOW_MAX_AGE = 30.0
+# Seconds a CATWorker sits idle before it reads the rig state back into the
+# shadow, so knob turns are picked up well before SHADOW_MAX_AGE runs out
+SHADOW_REFRESH_INTERVAL = 10.0
+# Which shadow entry each set method writes
+SHADOW_KEYS = {"set_vfo": "vfo", "set_mode": "mode", "set_power": "power"}
+
+
+class KeepAliveTransport(xmlrpc.client.Transport):
+    """
+    XML-RPC transport that asks flrig to keep the HTTP connection open.
+
+    The stock Transport already reuses its HTTP/1.1 connection (and reconnects
+    once if it went cold), but older XmlRpc++ servers like flrig's only keep a
+    connection alive when the request says so. Without the header every call
+    pays for a fresh TCP connect.
+    """
+
+    def send_headers(self, connection, headers):
+        super().send_headers(connection, headers + [("Connection", "keep-alive")])
+
 
 class CAT:
     """CAT control rigctld or flrig"""
@@ -62,11 +93,22 @@ class CAT:
 
         set_power()
 
+        batch()
+
         A variable 'online' is set to True if no error was encountered,
         otherwise False.
+
+        A shadow copy of the VFO, mode, passband and power is kept from the
+        values we last set or read. A set that would not change anything is
+        skipped. An entry is forgotten when a command fails, when we reconnect
+        or when it is older than SHADOW_MAX_AGE; refresh_shadow() reads
+        everything back from the rig (CATWorker does that whenever it's idle).
         """
         self.server = None
+        self.flrig_multicall = False
+        self.shadow = {}
         self.rigctrlsocket = None
+        self.rigctrlbuffer = b""
         self.interface = interface.lower()
         self.host = host
         self.port = port
@@ -78,6 +120,17 @@ class CAT:
             "power": "100",
             "modes": ["CW", "USB", "LSB", "RTTY"],
             "ptt": False,
+            # S-meter reading (dB over S9) on a quiet frequency, and the
+            # frequencies where someone is on the air
+            "strength": -54,
+            "signals": {},
+            "active_vfo": "A",
+            "vfo_b": "7032000",
+            "mode_b": "CW",
+            # Memory channel number -> (frequency, mode), and whether the rig
+            # is scanning them
+            "channels": {},
+            "scanning": False,
         }
 
         if self.interface == "flrig":
@@ -87,7 +140,7 @@ class CAT:
 
             target = f"http://{self.host}:{self.port}"
             logger.debug("%s", target)
-            self.server = xmlrpc.client.ServerProxy(target)
+            self.server = xmlrpc.client.ServerProxy(target, transport=KeepAliveTransport())
             self.online = True
             try:
                 _ = self.server.main.get_version()
@@ -99,6 +152,8 @@ class CAT:
                 socket.gaierror,
             ):
                 self.online = False
+            if self.online:
+                self.__detect_flrig_multicall()
         elif self.interface == "rigctld":
             if not self.__check_sane_ip(self.host):
                 self.online = False
@@ -109,6 +164,64 @@ class CAT:
             logger.debug("Using Fake Rig")
         return
 
+    def __detect_flrig_multicall(self):
+        """Checks whether flrig will take batches through system.multicall"""
+        try:
+            self.flrig_multicall = "system.multicall" in self.server.system.listMethods()
+        except (
+            xmlrpc.client.Fault,
+            http.client.BadStatusLine,
+            http.client.CannotSendRequest,
+            http.client.ResponseNotReady,
+            socket.error,
+        ) as exception:
+            self.flrig_multicall = False
+            logger.debug("flrig system.listMethods: %s", f"{exception}")
+        logger.debug(f"{self.flrig_multicall=}")
+
+    @staticmethod
+    def __shadow_value(key: str, value):
+        """Normalizes a value so equal settings compare equal ("7074000.0" is "7074000")"""
+        if key == "vfo":
+            try:
+                return str(int(float(value)))
+            except (TypeError, ValueError):
+                return None
+        return str(value)
+
+    def __shadow_matches(self, key: str, value) -> bool:
+        """True if the shadow copy says the rig already has this setting"""
+        entry = self.shadow.get(key)
+        if entry is None or time.monotonic() - entry[1] > SHADOW_MAX_AGE:
+            return False
+        return entry[0] == self.__shadow_value(key, value)
+
+    def __shadow_update(self, key: str, value, result):
+        """Records the outcome of a set (or a read back) and passes the result through"""
+        if result is not False and result != "" and result is not None and self.online:
+            self.shadow[key] = (self.__shadow_value(key, value), time.monotonic())
+            if key == "mode":
+                # Setting a mode picks the rig's default passband for it
+                self.shadow.pop("bw", None)
+        else:
+            self.shadow.pop(key, None)
+        return result
+
+    def invalidate_shadow(self, key: str = None) -> None:
+        """Forgets one entry (or all) of the shadow rig state"""
+        if key is None:
+            self.shadow.clear()
+        else:
+            self.shadow.pop(key, None)
+
+    def refresh_shadow(self) -> None:
+        """Reads the VFO, mode, passband and power back from the rig into the shadow"""
+        self.invalidate_shadow()
+        self.get_vfo()
+        self.get_mode()
+        self.get_bw()
+        self.get_power()
+
     def __check_sane_ip(self, ip: str) -> bool:
         """check if IP address look normal"""
         x = ip.split(".")
@@ -121,8 +234,11 @@ class CAT:
 
     def __initialize_rigctrld(self):
         try:
+            self.rigctrlbuffer = b""
+            # Who knows what happened to the rig while we weren't connected
+            self.invalidate_shadow()
             self.rigctrlsocket = socket.socket()
-            self.rigctrlsocket.settimeout(0.5)
+            self.rigctrlsocket.settimeout(RIGCTLD_CONNECT_TIMEOUT)
             self.rigctrlsocket.connect((self.host, self.port))
             logger.debug("Connected to rigctrld")
             self.online = True
@@ -142,19 +258,48 @@ class CAT:
         if self.interface == "rigctld":
             self.__initialize_rigctrld()
 
-    def __get_serial_string(self):
-        """Gets any serial data waiting"""
-        dump = ""
-        thegrab = ""
-        self.rigctrlsocket.settimeout(0.1)
+    def __get_rigctld_reply(self) -> str:
+        """
+        Reads one extended response from rigctld.
+
+        Commands are sent with the '|' (or '+') extended response prefix, so every
+        reply ends with an 'RPRT n' record. We return as soon as that record
+        arrives rather than waiting for the socket to go quiet. Anything read past
+        it stays buffered for the next reply.
+
+        A timeout raises socket.timeout, which callers treat like any other socket
+        error: the connection is dropped so the framing starts clean on reconnect.
+        """
+        lines = []
+        self.rigctrlsocket.settimeout(RIGCTLD_REPLY_TIMEOUT)
+        while True:
+            newline = self.rigctrlbuffer.find(b"\n")
+            if newline == -1:
+                chunk = self.rigctrlsocket.recv(1024)
+                if not chunk:
+                    raise ConnectionResetError("rigctld closed the connection")
+                self.rigctrlbuffer += chunk
+                continue
+            line = self.rigctrlbuffer[:newline].decode(errors="replace")
+            self.rigctrlbuffer = self.rigctrlbuffer[newline + 1 :]
+            lines.append(line)
+            # '|' replies are one line ending in '|RPRT n', '+' replies end with a
+            # line of their own
+            if line.rsplit("|", 1)[-1].startswith("RPRT "):
+                return "\n".join(lines)
+
+    def __rigctld_command(self, command: str) -> str:
+        """Sends one extended response command to rigctld and returns the reply"""
+        self.rigctrlsocket.sendall(bytes(f"{command}\n", "utf-8"))
+        return self.__get_rigctld_reply()
+
+    @staticmethod
+    def __rigctld_result(report: str) -> int:
+        """Returns the RPRT code at the end of an extended rigctld reply"""
         try:
-            while True:
-                thegrab += self.rigctrlsocket.recv(1024).decode()
-                dump += thegrab
-        except (socket.error, UnicodeDecodeError):
-            ...
-        self.rigctrlsocket.settimeout(0.5)
-        return dump
+            return int(report.rsplit("RPRT ", 1)[1])
+        except (IndexError, ValueError):
+            return -1
 
     def sendcw(self, texttosend):
         """..."""
@@ -169,9 +314,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(bytes(f"b{texttosend}\n", "utf-8"))
-                _ = self.__get_serial_string()
-                return True
+                report = self.__rigctld_command(f"|b{texttosend}")
+                return self.__rigctld_result(report) == 0
             except socket.error as exception:
                 self.online = False
                 logger.debug("setvfo_rigctld: %s", f"{exception}")
@@ -185,8 +329,7 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(bytes(f"L KEYSPD {speed}\n", "utf-8"))
-                _ = self.__get_serial_string()
+                _ = self.__rigctld_command(f"|L KEYSPD {speed}")
                 return
             except socket.error as exception:
                 self.online = False
@@ -260,7 +403,7 @@ class CAT:
                 vfo = ""
         else:
             vfo = self.fake_radio.get("vfo", "")
-        return vfo
+        return self.__shadow_update("vfo", vfo, vfo)
 
     def __getvfo_flrig(self) -> str:
         """Poll the radio using flrig"""
@@ -286,8 +429,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(b"|f\n")
-                report = self.__get_serial_string().strip()
+                # get_freq:|Frequency: 14074000|RPRT 0
+                report = self.__rigctld_command("|f").strip()
                 if "get_freq:|" in report and "RPRT 0" in report:
                     seg_rpt = report.split("|")
                     return seg_rpt[1].split(" ")[1]
@@ -309,6 +452,11 @@ class CAT:
             mode = self.__getmode_rigctld()
         else:
             mode = self.fake_radio.get("mode")
+        # Don't let a read back throw away a passband we know
+        bw = self.shadow.get("bw")
+        self.__shadow_update("mode", mode, mode)
+        if bw is not None and mode:
+            self.shadow["bw"] = bw
         return mode
 
     def __getmode_flrig(self) -> str:
@@ -339,9 +487,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(b"|m\n")
                 # get_mode:|Mode: CW|Passband: 500|RPRT 0
-                report = self.__get_serial_string().strip()
+                report = self.__rigctld_command("|m").strip()
                 if "get_mode:|" in report and "RPRT 0" in report:
                     seg_rpt = report.split("|")
                     return seg_rpt[1].split(" ")[1]
@@ -358,11 +505,12 @@ class CAT:
     def get_bw(self):
         """Get current vfo bandwidth"""
         if self.interface == "flrig":
-            return self.__getbw_flrig()
+            bw = self.__getbw_flrig()
         elif self.interface == "rigctld":
-            return self.__getbw_rigctld()
+            bw = self.__getbw_rigctld()
         else:
-            return self.fake_radio.get("bw")
+            bw = self.fake_radio.get("bw")
+        return self.__shadow_update("bw", bw, bw)
 
     def __getbw_flrig(self):
         """return bandwidth"""
@@ -388,9 +536,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(b"|m\n")
                 # get_mode:|Mode: CW|Passband: 500|RPRT 0
-                report = self.__get_serial_string().strip()
+                report = self.__rigctld_command("|m").strip()
                 if "get_mode:|" in report and "RPRT 0" in report:
                     seg_rpt = report.split("|")
                     return seg_rpt[2].split(" ")[1]
@@ -408,11 +555,12 @@ class CAT:
     def get_power(self):
         """Get power level from rig"""
         if self.interface == "flrig":
-            return self.__getpower_flrig()
+            power = self.__getpower_flrig()
         elif self.interface == "rigctld":
-            return self.__getpower_rigctld()
+            power = self.__getpower_rigctld()
         else:
-            return self.fake_radio.get("power", "100")
+            power = self.fake_radio.get("power", "100")
+        return self.__shadow_update("power", power, power)
 
     def __getpower_flrig(self):
         try:
@@ -433,9 +581,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(b"|l RFPOWER\n")
                 # get_level: RFPOWER|0.000000|RPRT 0
-                report = self.__get_serial_string().strip()
+                report = self.__rigctld_command("|l RFPOWER").strip()
                 if "get_level: RFPOWER|" in report and "RPRT 0" in report:
                     seg_rpt = report.split("|")
                     return int(float(seg_rpt[1]) * 100)
@@ -445,6 +592,53 @@ class CAT:
                 self.rigctrlsocket = None
             return ""
 
+    def get_strength(self):
+        """
+        Reads the S-meter, in dB relative to S9 (S9 is 0, S0 about -54, S9+20
+        is 20). Returns None if the rig can't tell us.
+        """
+        if self.interface == "flrig":
+            return self.__getstrength_flrig()
+        elif self.interface == "rigctld":
+            return self.__getstrength_rigctld()
+        # Stations on the air are in fake_radio["signals"], by frequency
+        return self.fake_radio["signals"].get(self.fake_radio["vfo"], self.fake_radio["strength"])
+
+    def __getstrength_flrig(self):
+        try:
+            self.online = True
+            meter = float(self.server.rig.get_smeter())
+        except (
+            ConnectionRefusedError,
+            xmlrpc.client.Fault,
+            http.client.BadStatusLine,
+            http.client.CannotSendRequest,
+            http.client.ResponseNotReady,
+        ) as exception:
+            self.online = False
+            logger.debug("getstrength_flrig: %s", f"{exception}")
+            return None
+        except (TypeError, ValueError):
+            return None
+        # flrig's meter runs from 0 to 100, with S9 at 50 and S9+60 at the top
+        return round((meter - 50) * (54 if meter <= 50 else 60) / 50)
+
+    def __getstrength_rigctld(self):
+        if self.rigctrlsocket:
+            try:
+                self.online = True
+                # get_level: STRENGTH|-54|RPRT 0
+                report = self.__rigctld_command("|l STRENGTH").strip()
+                if self.__rigctld_result(report) == 0:
+                    return int(float(report.split("|")[1]))
+            except socket.error as exception:
+                self.online = False
+                logger.debug("getstrength_rigctld: %s", f"{exception}")
+                self.rigctrlsocket = None
+            except (IndexError, ValueError) as exception:
+                logger.debug("getstrength_rigctld: %s", f"{exception}")
+        return None
+
     def get_ptt(self):
         """Get PTT state"""
         if self.interface == "flrig":
@@ -474,11 +668,13 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(b"t\n")
-                ptt = self.__get_serial_string()
-                logger.debug("%s", ptt)
-                ptt = ptt.strip()
-                return ptt
+                # get_ptt:|PTT: 0|RPRT 0
+                report = self.__rigctld_command("|t").strip()
+                logger.debug("%s", report)
+                if "get_ptt:|" in report and "RPRT 0" in report:
+                    return report.split("|")[1].split(" ")[1]
+            except IndexError as exception:
+                logger.debug("%s", f"{exception}")
             except socket.error as exception:
                 self.online = False
                 logger.debug("%s", f"{exception}")
@@ -520,8 +716,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(b"1\n")
-                dump = self.__get_serial_string()
+                # '+' puts each field on its own line, ending with RPRT 0
+                dump = self.__rigctld_command("+1")
                 for line in dump.splitlines():
                     if "Mode list:" in line:
                         modes = line.split(":")[1].strip()
@@ -534,18 +730,21 @@ class CAT:
         return ""
 
     def set_vfo(self, freq: str) -> bool:
-        """Sets the radios vfo"""
+        """Sets the radios vfo, unless the shadow says it's already there"""
+        if self.__shadow_matches("vfo", freq):
+            return True
+        result = False
         try:
             if self.interface == "flrig":
-                return self.__setvfo_flrig(freq)
+                result = self.__setvfo_flrig(freq)
             elif self.interface == "rigctld":
-                return self.__setvfo_rigctld(freq)
+                result = self.__setvfo_rigctld(freq)
             else:
                 self.fake_radio["vfo"] = str(freq)
-                return True
+                result = True
         except ValueError:
             ...
-        return False
+        return self.__shadow_update("vfo", freq, result)
 
     def __setvfo_flrig(self, freq: str) -> bool:
         """Sets the radios vfo"""
@@ -569,9 +768,8 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(bytes(f"F {freq}\n", "utf-8"))
-                _ = self.__get_serial_string()
-                return True
+                report = self.__rigctld_command(f"|F {freq}")
+                return self.__rigctld_result(report) == 0
             except socket.error as exception:
                 self.online = False
                 logger.debug("setvfo_rigctld: %s", f"{exception}")
@@ -581,14 +779,17 @@ class CAT:
         return False
 
     def set_mode(self, mode: str) -> bool:
-        """Sets the radios mode"""
+        """Sets the radios mode, unless the shadow says it's already set"""
+        if self.__shadow_matches("mode", mode):
+            return True
         if self.interface == "flrig":
-            return self.__setmode_flrig(mode)
+            result = self.__setmode_flrig(mode)
         elif self.interface == "rigctld":
-            return self.__setmode_rigctld(mode)
+            result = self.__setmode_rigctld(mode)
         else:
             self.fake_radio["mode"] = mode
-            return True
+            result = True
+        return self.__shadow_update("mode", mode, result)
 
     def __setmode_flrig(self, mode: str) -> bool:
         """Sets the radios mode"""
@@ -615,11 +816,9 @@ class CAT:
         if self.rigctrlsocket:
             try:
                 self.online = True
-                self.rigctrlsocket.send(bytes(f"\nM {mode} 0\n", "utf-8"))
-                if self.__get_serial_string() != "RPRT 0\n":
-                    self.rigctrlsocket.send(bytes(f"\nM {mode} 0\n", "utf-8"))
-                _ = self.__get_serial_string()
-                return True
+                # A passband of 0 keeps the rig's default filter for the mode
+                report = self.__rigctld_command(f"|M {mode} 0")
+                return self.__rigctld_result(report) == 0
             except socket.error as exception:
                 self.online = False
                 logger.debug("setmode_rigctld: %s", f"{exception}")
@@ -629,14 +828,17 @@ class CAT:
         return False
 
     def set_power(self, power):
-        """Sets the radios power"""
+        """Sets the radios power, unless the shadow says it's already set"""
+        if self.__shadow_matches("power", power):
+            return True
         if self.interface == "flrig":
-            return self.__setpower_flrig(power)
+            result = self.__setpower_flrig(power)
         elif self.interface == "rigctld":
-            return self.__setpower_rigctld(power)
+            result = self.__setpower_rigctld(power)
         else:
             self.fake_radio["power"] = str(power)
-            return True
+            result = True
+        return self.__shadow_update("power", power, result)
 
     def __setpower_flrig(self, power):
         try:
@@ -656,15 +858,309 @@ class CAT:
 
     def __setpower_rigctld(self, power):
         if power.isnumeric() and int(power) >= 1 and int(power) <= 100:
-            rig_cmd = bytes(f"L RFPOWER {str(float(power) / 100)}\n", "utf-8")
+            rig_cmd = f"|L RFPOWER {str(float(power) / 100)}"
             try:
                 self.online = True
-                self.rigctrlsocket.send(rig_cmd)
-                _ = self.__get_serial_string()
+                _ = self.__rigctld_command(rig_cmd)
             except socket.error:
                 self.online = False
                 self.rigctrlsocket = None
 
+    def batch(self, operations: list) -> list:
+        """
+        Runs several set operations as one unit. Takes a list of
+        (method name, value) pairs, for example:
+
+        rig.batch([("set_vfo", "14074000"), ("set_mode", "USB")])
+
+        Supported methods are set_vfo, set_mode and set_power. On rigctld the
+        commands all go out in a single send and the replies are matched back
+        in order; on flrig they go out as one system.multicall request if flrig
+        supports it. Either way a whole tune costs one round trip. Otherwise
+        the operations run one after another.
+
+        Operations the shadow rig state says are already in effect are left
+        out of the batch and reported as successful.
+
+        Returns a list with the result of each operation, in order. Raises
+        ValueError for a method that isn't supported.
+        """
+        for name, _ in operations:
+            if name not in SHADOW_KEYS:
+                raise ValueError(f"{name} can not be batched")
+        results = [True] * len(operations)
+        pending = [
+            i for i, (name, value) in enumerate(operations)
+            if not self.__shadow_matches(SHADOW_KEYS[name], value)
+        ]
+        if not pending:
+            return results
+        to_send = [operations[i] for i in pending]
+        if self.interface == "rigctld":
+            sent = self.__batch_rigctld(to_send)
+        elif self.interface == "flrig" and self.flrig_multicall:
+            sent = self.__batch_flrig(to_send)
+        else:
+            # The set methods keep the shadow up to date themselves
+            sent = [getattr(self, name)(value) for name, value in to_send]
+            for i, result in zip(pending, sent):
+                results[i] = result
+            return results
+
+        for i, result in zip(pending, sent):
+            name, value = operations[i]
+            results[i] = self.__shadow_update(SHADOW_KEYS[name], value, result)
+        return results
+
+    def __batch_flrig(self, operations: list) -> list:
+        """Sends a batch of set operations to flrig as one system.multicall"""
+        return self.__multicall_flrig([self.__flrig_set_call(name, value) for name, value in operations])
+
+    def __multicall_flrig(self, calls: list) -> list:
+        """
+        Makes several flrig calls, each a (method, *arguments) tuple. They go
+        as one system.multicall if flrig supports it, otherwise one at a time.
+        Returns whether each one worked.
+        """
+        if not self.flrig_multicall:
+            return [self.__call_flrig(*call) for call in calls]
+        multicall = xmlrpc.client.MultiCall(self.server)
+        for method, *arguments in calls:
+            getattr(multicall, method)(*arguments)
+        try:
+            self.online = True
+            replies = multicall()
+        except (
+            ConnectionRefusedError,
+            xmlrpc.client.Fault,
+            http.client.BadStatusLine,
+            http.client.CannotSendRequest,
+            http.client.ResponseNotReady,
+            socket.error,
+        ) as exception:
+            self.online = False
+            logger.debug("multicall_flrig: %s", f"{exception}")
+            return [False] * len(calls)
+
+        # Each call in the batch succeeds or faults on its own
+        results = []
+        for i in range(len(calls)):
+            try:
+                results.append(replies[i] is not False)
+            except xmlrpc.client.Fault as exception:
+                logger.debug("multicall_flrig: %s", f"{exception}")
+                results.append(False)
+        return results
+
+    def __call_flrig(self, method: str, *arguments) -> bool:
+        """Makes one flrig call, returning whether it worked"""
+        try:
+            self.online = True
+            function = self.server
+            for part in method.split("."):
+                function = getattr(function, part)
+            return function(*arguments) is not False
+        except (
+            ConnectionRefusedError,
+            xmlrpc.client.Fault,
+            http.client.BadStatusLine,
+            http.client.CannotSendRequest,
+            http.client.ResponseNotReady,
+            socket.error,
+        ) as exception:
+            self.online = False
+            logger.debug("%s: %s", method, f"{exception}")
+        return False
+
+    @staticmethod
+    def __flrig_set_call(name: str, value) -> tuple:
+        """Translates a batch operation into its flrig method and argument"""
+        if name == "set_vfo":
+            return "rig.set_frequency", float(value)
+        if name == "set_mode":
+            return "rig.set_mode", value
+        if name == "set_power":
+            return "rig.set_power", value
+        raise ValueError(f"{name} can not be batched")
+
+    def __batch_rigctld(self, operations: list) -> list:
+        """Pipelines a batch of set operations through rigctld"""
+        return self.__pipeline_rigctld(
+            [self.__rigctld_set_command(name, value) for name, value in operations]
+        )
+
+    def __pipeline_rigctld(self, commands: list) -> list:
+        """
+        Sends several extended rigctld commands in a single send, and returns
+        whether each one worked
+        """
+        if self.rigctrlsocket:
+            try:
+                self.online = True
+                self.rigctrlsocket.sendall(
+                    bytes("".join(f"{command}\n" for command in commands), "utf-8")
+                )
+                # rigctld handles one connection's commands strictly in order, so
+                # the nth reply belongs to the nth command
+                return [
+                    self.__rigctld_result(self.__get_rigctld_reply()) == 0
+                    for _ in commands
+                ]
+            except socket.error as exception:
+                self.online = False
+                logger.debug("pipeline_rigctld: %s", f"{exception}")
+                self.rigctrlsocket = None
+                return [False] * len(commands)
+        self.__initialize_rigctrld()
+        return [False] * len(commands)
+
+    @staticmethod
+    def __rigctld_set_command(name: str, value) -> str:
+        """Translates a batch operation into its extended rigctld command"""
+        if name == "set_vfo":
+            return f"|F {value}"
+        if name == "set_mode":
+            return f"|M {value} 0"
+        if name == "set_power":
+            return f"|L RFPOWER {str(float(value) / 100)}"
+        raise ValueError(f"{name} can not be batched")
+
+    def select_vfo(self, vfo: str) -> bool:
+        """Makes VFO 'A' or 'B' the one we're listening on (and setting)"""
+        vfo = vfo.upper()
+        if vfo not in ("A", "B"):
+            raise ValueError(f"No such VFO: {vfo}")
+        if self.interface == "flrig":
+            result = self.__multicall_flrig([("rig.set_AB", vfo)])[0]
+        elif self.interface == "rigctld":
+            result = self.__pipeline_rigctld([f"|V VFO{vfo}"])[0]
+        else:
+            self.fake_radio["active_vfo"] = vfo
+            result = True
+        # The shadow was of the other VFO
+        self.invalidate_shadow()
+        return result
+
+    def preset_vfo_b(self, freq: str, mode: str) -> bool:
+        """
+        Loads a frequency and mode into VFO B, leaving A (the one we're
+        listening on) alone, so a later swap_vfo() can jump there at once.
+
+        On rigctld this selects B, sets it and selects A again, all in one
+        send. On flrig it's rig.set_vfoB and rig.set_modeB, in one
+        system.multicall if flrig supports it.
+        """
+        if self.interface == "flrig":
+            try:
+                results = self.__multicall_flrig([("rig.set_vfoB", float(freq)),
+                                                  ("rig.set_modeB", mode)])
+            except ValueError:
+                return False
+        elif self.interface == "rigctld":
+            results = self.__pipeline_rigctld(["|V VFOB", f"|F {freq}", f"|M {mode} 0", "|V VFOA"])
+        else:
+            self.fake_radio["vfo_b"] = str(freq)
+            self.fake_radio["mode_b"] = mode
+            results = [True]
+        return all(results)
+
+    def swap_vfo(self) -> bool:
+        """
+        Exchanges VFOs A and B with a single command (rigctld 'G XCHG', flrig
+        rig.swap), so we're straight onto whatever preset_vfo_b() loaded.
+        """
+        if self.interface == "flrig":
+            result = self.__multicall_flrig([("rig.swap",)])[0]
+        elif self.interface == "rigctld":
+            result = self.__pipeline_rigctld(["|G XCHG"])[0]
+        else:
+            radio = self.fake_radio
+            radio["vfo"], radio["vfo_b"] = radio["vfo_b"], radio["vfo"]
+            radio["mode"], radio["mode_b"] = radio["mode_b"], radio["mode"]
+            result = True
+        self.invalidate_shadow()
+        return result
+
+    def __vfo_a_state(self) -> tuple:
+        """
+        VFO A's frequency, mode and passband - from the shadow if it's fresh,
+        otherwise read from the rig ("" for anything we couldn't get)
+        """
+        keys = ("vfo", "mode", "bw")
+        now = time.monotonic()
+        if all(key in self.shadow and now - self.shadow[key][1] <= SHADOW_MAX_AGE for key in keys):
+            return tuple(self.shadow[key][0] for key in keys)
+        self.select_vfo("A")
+        return (self.get_vfo(), self.get_mode(), self.get_bw())
+
+    def set_channel(self, channel: int, freq: str, mode: str) -> bool:
+        """
+        Stores a frequency and mode in a memory channel, leaving VFO A as it
+        was.
+
+        On rigctld the frequency and mode are set on VFO A first, then the
+        channel is selected ('E') and VFO A copied into it ('G FROM_VFO').
+        Selecting the channel first would put many rigs (most Icoms) into
+        memory mode, where 'F' and 'M' change the memory's working frequency
+        instead of the VFO. Then it's back to VFO A, and whatever the operator
+        had there is put back. It all goes in one send. This works with
+        Hamlib's memory support on more rigs than 'H' (set_channel) does,
+        which asks for a different set of fields on every rig. flrig has no
+        way to program memories, so there it returns False.
+        """
+        if self.interface == "rigctld":
+            freq_a, mode_a, bw_a = self.__vfo_a_state()
+            commands = ["|V VFOA", f"|F {freq}", f"|M {mode} 0", f"|E {int(channel)}",
+                        "|G FROM_VFO", "|V VFOA"]
+            restore = [f"|F {freq_a}", f"|M {mode_a} {bw_a or 0}"] if freq_a and mode_a else []
+            results = self.__pipeline_rigctld(commands + restore)
+            if restore and all(results[len(commands):]):
+                # VFO A is just as it was
+                self.__shadow_update("vfo", freq_a, True)
+                self.__shadow_update("mode", mode_a, True)
+                if bw_a:
+                    self.__shadow_update("bw", bw_a, True)
+            else:
+                logger.debug("set_channel: unable to put VFO A back")
+                self.invalidate_shadow()
+            return all(results[:len(commands)])
+        if self.interface == "flrig":
+            return False
+        self.fake_radio["channels"][int(channel)] = (str(freq), mode)
+        return True
+
+    def clear_channel(self, channel: int) -> bool:
+        """
+        Empties a memory channel ('E' then 'G MCL' on rigctld), so the rig's
+        scan skips it, and goes back to VFO A
+        """
+        if self.interface == "rigctld":
+            return all(self.__pipeline_rigctld([f"|E {int(channel)}", "|G MCL", "|V VFOA"])[:2])
+        if self.interface == "flrig":
+            return False
+        self.fake_radio["channels"].pop(int(channel), None)
+        return True
+
+    def start_memory_scan(self) -> bool:
+        """Puts the rig in memory mode and starts its own memory scan ('V MEM', 'g MEM 0')"""
+        if self.interface == "rigctld":
+            self.invalidate_shadow()
+            return all(self.__pipeline_rigctld(["|V MEM", "|g MEM 0"]))
+        if self.interface == "flrig":
+            return False
+        self.fake_radio["scanning"] = True
+        return True
+
+    def stop_scan(self) -> bool:
+        """Stops the rig's own scan and goes back to VFO A ('g STOP 0', 'V VFOA')"""
+        if self.interface == "rigctld":
+            self.invalidate_shadow()
+            return all(self.__pipeline_rigctld(["|g STOP 0", "|V VFOA"]))
+        if self.interface == "flrig":
+            return False
+        self.fake_radio["scanning"] = False
+        return True
+
     def ptt_on(self):
         """turn ptt on/off"""
         if self.interface == "flrig":
@@ -686,12 +1182,11 @@ class CAT:
         # Get 'PTT' status.
         # Returns PTT as a value in set_ptt above.
 
-        rig_cmd = bytes("T 1\n", "utf-8")
+        rig_cmd = "|T 1"
         logger.debug("%s", f"{rig_cmd}")
         try:
             self.online = True
-            self.rigctrlsocket.send(rig_cmd)
-            _ = self.__get_serial_string()
+            _ = self.__rigctld_command(rig_cmd)
         except socket.error:
             self.online = False
             self.rigctrlsocket = None
@@ -725,12 +1220,11 @@ class CAT:
 
     def __ptt_off_rigctld(self):
         """Toggle PTT state off"""
-        rig_cmd = bytes("T 0\n", "utf-8")
+        rig_cmd = "|T 0"
         logger.debug("%s", f"{rig_cmd}")
         try:
             self.online = True
-            self.rigctrlsocket.send(rig_cmd)
-            _ = self.__get_serial_string()
+            _ = self.__rigctld_command(rig_cmd)
         except socket.error:
             self.online = False
             self.rigctrlsocket = None
@@ -751,3 +1245,159 @@ class CAT:
             self.online = False
             logger.debug("%s", f"{exception}")
         return "0"
+
+
+class CATWorker:
+    """Owns a CAT connection on a thread of its own"""
+
+    def __init__(self, interface: str, host: str, port: int, on_connect=None) -> None:
+        """
+        Runs all rig I/O, including the initial connect, on a background thread so
+        the caller (usually the GUI) never waits on the rig.
+
+        Takes the same interface, host and port as CAT. on_connect, if given, is
+        called from the worker thread with the 'online' result once the
+        connection attempt finishes.
+
+        Tune requests are latest-wins: tune() replaces any tune that has not been
+        sent yet, so a slow rig only ever catches up to the newest frequency
+        instead of working through a backlog of stale ones. pretune(), which
+        loads VFO B, works the same way. Everything else submitted with
+        submit() runs in order, ahead of any waiting tune or pretune.
+
+        When there's nothing to do for SHADOW_REFRESH_INTERVAL, the rig state
+        is read back into the CAT shadow, in case the operator changed it.
+        """
+        self.rig = None
+        self.online = False
+        self.__wakeup = threading.Condition()
+        self.__jobs = collections.deque()
+        self.__pending_tune = None
+        self.__pending_pretune = None
+        # What pretune() last asked to load into VFO B, and (on the worker
+        # thread) what B is known to hold
+        self.__preset = None
+        self.__vfo_b = None
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name="cat-worker", daemon=True)
+        self.__thread.start()
+        self.submit(self.__connect, interface, host, port, callback=on_connect)
+
+    def __connect(self, interface: str, host: str, port: int) -> bool:
+        self.rig = CAT(interface, host, port)
+        return self.rig.online
+
+    def submit(self, method, *args, callback=None) -> None:
+        """
+        Queues a call on the worker thread. method is either a callable or the
+        name of a CAT method. callback, if given, is called from the worker
+        thread with the result.
+        """
+        with self.__wakeup:
+            self.__jobs.append((method, args, callback))
+            self.__wakeup.notify()
+
+    def tune(self, freq: str, mode: str) -> None:
+        """Queues a frequency and mode change, replacing any that is still waiting"""
+        with self.__wakeup:
+            if self.__pending_tune is not None:
+                logger.debug("dropping stale tune %s", self.__pending_tune)
+            self.__pending_tune = (freq, mode)
+            self.__wakeup.notify()
+
+    def pretune(self, freq: str, mode: str, callback=None) -> None:
+        """
+        Queues loading VFO B, replacing any pretune that is still waiting.
+        callback, if given, is called from the worker thread with whether B
+        took it.
+        """
+        with self.__wakeup:
+            self.__pending_pretune = (freq, mode, callback)
+            self.__preset = (freq, mode)
+            self.__wakeup.notify()
+
+    def swap(self) -> None:
+        """
+        Queues a VFO A/B swap, to go to whatever pretune() loaded into B. If
+        that pretune hasn't gone out yet there's nothing in B to swap to, so
+        it's sent as a plain tune instead. So is a pretune that failed, or a
+        swap the rig won't do.
+        """
+        with self.__wakeup:
+            if self.__pending_pretune is not None:
+                self.__pending_tune = self.__pending_pretune[:2]
+                self.__pending_pretune = None
+            else:
+                self.__jobs.append((self.__swap, (self.__preset,), None))
+            self.__preset = None
+            self.__wakeup.notify()
+
+    def stop(self) -> None:
+        """Stops the worker once the call in progress (if any) finishes"""
+        with self.__wakeup:
+            self.__running = False
+            self.__wakeup.notify()
+
+    def __run(self) -> None:
+        while True:
+            with self.__wakeup:
+                idle = False
+                while (self.__running and not self.__jobs and self.__pending_tune is None
+                       and self.__pending_pretune is None):
+                    if not self.__wakeup.wait(SHADOW_REFRESH_INTERVAL):
+                        idle = True
+                        break
+                if not self.__running:
+                    return
+                if self.__jobs:
+                    method, args, callback = self.__jobs.popleft()
+                elif idle:
+                    method, args, callback = self.__read_back, (), None
+                elif self.__pending_tune is not None:
+                    freq, mode = self.__pending_tune
+                    self.__pending_tune = None
+                    method, args, callback = self.__tune, (freq, mode), None
+                else:
+                    freq, mode, callback = self.__pending_pretune
+                    self.__pending_pretune = None
+                    method, args = self.__preset_vfo_b, (freq, mode)
+
+            if isinstance(method, str):
+                method = getattr(self.rig, method)
+            try:
+                result = method(*args)
+            except Exception as exception:  # pylint: disable=broad-except
+                # Keep the worker alive; a broken call must not take rig control with it
+                logger.exception("CAT worker call failed: %s", exception)
+                result = None
+            if self.rig is not None:
+                self.online = self.rig.online
+            if callback is not None:
+                callback(result)
+
+    def __read_back(self) -> None:
+        if self.rig is not None and self.rig.online:
+            self.rig.refresh_shadow()
+
+    def __tune(self, freq: str, mode: str) -> list:
+        return self.rig.batch([("set_vfo", freq), ("set_mode", mode)])
+
+    def __preset_vfo_b(self, freq: str, mode: str) -> bool:
+        self.__vfo_b = None
+        loaded = self.rig.preset_vfo_b(freq, mode)
+        if loaded:
+            self.__vfo_b = (freq, mode)
+        return loaded
+
+    def __swap(self, preset) -> bool:
+        """Swaps to preset (what pretune() loaded into B), or tunes there if B doesn't have it"""
+        if preset is not None and self.__vfo_b != preset:
+            logger.debug("VFO B didn't take %s, tuning there instead", preset)
+            return all(self.__tune(*preset))
+        self.__vfo_b = None
+        if self.rig.swap_vfo():
+            return True
+        if preset is None:
+            return False
+        logger.debug("VFO swap failed, tuning to %s instead", preset)
+        return all(self.__tune(*preset))
@@ -20,10 +20,14 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import wx, wx.lib.scrolledpanel, wx.lib.intctrl
+import wx, wx.lib.intctrl
+import os
 import pota
+import scan
 import platform
-from cat_interface import CAT
+import time
+# cat_interface (and with it xmlrpc and http) is imported when we first connect,
+# and pota imports requests on its first fetch - neither is needed to show the window
 
 # Button labels
 SCAN_START_LABEL = "Scan"
@@ -32,13 +36,25 @@ SCAN_STOP_LABEL = "Stop"
 # Version info
 APP_VERSION = "0.1.0"
 
+# View menu labels
+VIEW_CARDS_LABEL = "&Cards"
+VIEW_LIST_LABEL = "&List"
+
 # Window defaults
 DEFAULT_WINDOW_SIZE = (1200, 800)
-DEFAULT_SCAN_INTERVAL = 5
+DEFAULT_SCAN_INTERVAL = scan.DEFAULT_SCAN_INTERVAL
+
+# When STARTUP_BENCH_ENV is set, we print FIRST_PAINT_MARKER on first paint and quit
+STARTUP_BENCH_ENV = "POTASCAN_STARTUP_BENCH"
+FIRST_PAINT_MARKER = "POTASCAN_FIRST_PAINT"
 
 def isMac():
     return platform.system() == "Darwin"
 
+def formatFreq(freq_hz):
+    '''Formats a frequency in Hz the way spots show it: kHz, with decimals only if needed'''
+    return str(freq_hz // 1000) if freq_hz % 1000 == 0 else str(freq_hz / 1000)
+
 BAND_STRINGS_TO_BANDS ={
     "ALL" : None,
     "10 Meters": pota.Band.METERS_10,
@@ -57,8 +73,21 @@ MODE_STRINGS_TO_MODES = {
     "CW": pota.Mode.CW
 }
 
+# Orders to scan in. By band keeps band changes (and tuner cycles) to a minimum.
+ORDER_STRINGS_TO_ORDERS = {
+    "By Band": scan.ScanOrder.FREQUENCY,
+    "As Spotted": scan.ScanOrder.FEED
+}
+
+# Which spots count as repeats of each other. Only the latest of them is shown.
+DEDUP_STRINGS_TO_KEYS = {
+    "Call": pota.DedupKey.ACTIVATOR,
+    "Call + Park": pota.DedupKey.ACTIVATOR_PARK,
+    "Call + Frequency": pota.DedupKey.ACTIVATOR_FREQUENCY
+}
+
 class SpotWidget(wx.StaticBoxSizer):
-    '''A widget to represent spots. Also contains business logic for scanning and rig interface'''
+    '''A widget to represent a spot as a card'''
     # Class-level attributes will be initialized when wx.App exists
     ACTIVE_BG = None
     ACTIVE_FG = None
@@ -74,20 +103,19 @@ class SpotWidget(wx.StaticBoxSizer):
             cls.INACTIVE_BG = wx.SystemSettings.GetColour(wx.SYS_COLOUR_WINDOW)
             cls.INACTIVE_FG = wx.SystemSettings.GetColour(wx.SYS_COLOUR_WINDOWTEXT)
 
-    def __init__(self, parent, call, park, freq, rig=None, *args, **kw):
-        self.box = wx.StaticBox(parent, label=call)
+    def __init__(self, parent, spot, *args, **kw):
+        self.box = wx.StaticBox(parent, label=spot.activator)
         self.box.SetBackgroundColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU))
         super().__init__(self.box, wx.VERTICAL, *args, **kw)
         self.labels = [
-            wx.StaticText(parent, label="PARK: " + park),
-            wx.StaticText(parent, label="Freq: " + freq)
+            wx.StaticText(parent, label="PARK: " + spot.park),
+            wx.StaticText(parent, label="Freq: " + formatFreq(spot.frequency))
         ]
         for label in self.labels:
             label.SetForegroundColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENUTEXT))
             self.Add(label, 0, flag=wx.ALL, border=5)
 
-        self.freq = freq
-        self.rig = rig
+        self.spot = spot
 
     def MakeActive(self):
         self.box.SetBackgroundColour(self.ACTIVE_BG)
@@ -100,16 +128,17 @@ class SpotWidget(wx.StaticBoxSizer):
         if not isMac():
             self.box.SetForegroundColour(self.ACTIVE_FG)
 
-        if self.rig and self.rig.online:
-            # Actually tune the rig!
-            freq_hz = int(float(self.freq) * 1000)           
-            # Set the frequency
-            self.rig.set_vfo(str(freq_hz))
-            
-            # At least for my icom, the auto mode switching (USB/LSB) does not happen
-            # if the frequency is set via CAT - so set it explicitly
-            mode = "USB" if freq_hz > 10000000 else "LSB"
-            self.rig.set_mode(mode) 
+    def Update(self, spot):
+        '''Shows a different spot - a newer one for the same activator, or a recycled card'''
+        self.box.SetLabel(spot.activator)
+        self.labels[0].SetLabel("PARK: " + spot.park)
+        self.labels[1].SetLabel("Freq: " + formatFreq(spot.frequency))
+        self.spot = spot
+
+    def DestroyWindows(self):
+        '''Destroys our controls. Detach us from our sizer first.'''
+        self.Clear(delete_windows=True)
+        self.box.Destroy()
 
     def Reset(self):
         self.box.SetBackgroundColour(wx.SystemSettings.GetColour(wx.SYS_COLOUR_MENU))
@@ -119,7 +148,218 @@ class SpotWidget(wx.StaticBoxSizer):
 
 
     def GetFreq(self):
-        return self.freq
+        return self.spot.frequency
+
+
+class SpotCardView(wx.ScrolledWindow):
+    '''
+    Shows the spots as a wrapping grid of SpotWidget cards.
+
+    Cards are pooled by dedup key for as long as their spot is in the snapshot,
+    so changing the band or mode filter just shows and hides cards that already
+    exist. Cards for spots that drop out of the snapshot are kept hidden and
+    reused for new ones instead of being destroyed.
+    '''
+    # Most spare cards we hang on to for reuse
+    MAX_SPARE_WIDGETS = 200
+
+    def __init__(self, parent):
+        super().__init__(parent, style=wx.VSCROLL)
+        # TODO: Scrolling doesn't work right when the contents shrink
+        self.SetScrollRate(10, 10)
+        # This holds our spots. Every card we have is in here, shown or not.
+        self.sizer_spots = wx.WrapSizer(orient=wx.HORIZONTAL)
+        self.SetSizer(self.sizer_spots)
+        # Cards for the spots in the snapshot, by dedup key, and the spare ones
+        self.spot_widgets = {}
+        self.spare_widgets = []
+        self.snapshot = []
+        # The cards that are showing, in order
+        self.shown = []
+        self.dedup_key = pota.DedupKey.ACTIVATOR
+        self.active = None
+        # Set when a card on show was relabelled, and might not fit any more
+        self.needs_layout = False
+
+    def recycle(self, widget):
+        '''Puts a card we don't need any more aside for reuse'''
+        if len(self.spare_widgets) < self.MAX_SPARE_WIDGETS:
+            self.sizer_spots.Show(widget, False)
+            self.spare_widgets.append(widget)
+        else:
+            self.sizer_spots.Detach(widget)
+            widget.DestroyWindows()
+
+    def SetSnapshot(self, spots, dedup_key):
+        '''Called with every spot (not just the filtered ones) when a new snapshot arrives'''
+        if dedup_key != self.dedup_key:
+            # Everything is keyed differently - recycle it all
+            self.SetSnapshot([], self.dedup_key)
+            self.dedup_key = dedup_key
+        delta = pota.diffSpots(self.snapshot, spots, dedup_key)
+        self.Freeze()
+        for key in delta.removed:
+            widget = self.spot_widgets.pop(key, None)
+            if widget is not None:
+                if widget is self.active:
+                    self.SetActive(None)
+                self.recycle(widget)
+        shown = set(map(id, self.shown))
+        for x in delta.changed:
+            widget = self.spot_widgets.get(dedup_key.of(x))
+            if widget is not None:
+                widget.Update(x)
+                self.needs_layout = self.needs_layout or id(widget) in shown
+        self.snapshot = spots
+        self.shown = [widget for widget in self.shown if widget.spot is not None
+                      and self.spot_widgets.get(dedup_key.of(widget.spot)) is widget]
+        self.Thaw()
+
+    def widgetFor(self, spot):
+        '''The card for a spot - pooled, recycled or (last resort) brand new'''
+        key = self.dedup_key.of(spot)
+        widget = self.spot_widgets.get(key)
+        if widget is None:
+            if self.spare_widgets:
+                widget = self.spare_widgets.pop()
+                widget.Update(spot)
+            else:
+                widget = SpotWidget(self, spot)
+                self.sizer_spots.Add(widget, 0, flag = wx.ALL, border=5)
+            self.spot_widgets[key] = widget
+        elif widget.spot != spot:
+            widget.Update(spot)
+            self.needs_layout = True
+        return widget
+
+    def ShowSpots(self, spots, dedup_key):
+        '''Shows these spots, in this order'''
+        self.SetActive(None)
+        if dedup_key != self.dedup_key:
+            self.SetSnapshot(self.snapshot, dedup_key)
+
+        self.Freeze()
+        wanted = [self.widgetFor(x) for x in spots]
+        if wanted != self.shown:
+            wanted_set = set(map(id, wanted))
+            for widget in self.shown:
+                if id(widget) not in wanted_set:
+                    self.sizer_spots.Show(widget, False)
+            # The shown cards go first, in order; the hidden ones trail behind.
+            # Cards that are already in place are left alone.
+            for i, widget in enumerate(wanted):
+                item = self.sizer_spots.GetItem(i)
+                if item is None or item.GetSizer() is not widget:
+                    self.sizer_spots.Detach(widget)
+                    self.sizer_spots.Insert(i, widget, 0, flag = wx.ALL, border=5)
+                self.sizer_spots.Show(widget, True)
+            self.shown = wanted
+            self.needs_layout = True
+        if self.needs_layout:
+            # One layout for the whole batch
+            self.needs_layout = False
+            self.Layout()
+            self.FitInside()
+        self.Thaw()
+
+    def SetActive(self, spot):
+        '''Highlights the spot we're tuned to (None for none)'''
+        if self.active is not None:
+            self.active.Reset()
+            self.active = None
+        if spot is not None:
+            self.active = self.spot_widgets.get(self.dedup_key.of(spot))
+            if self.active is not None:
+                self.active.MakeActive()
+
+
+def formatSpotTime(timestamp):
+    '''Formats a spot's timestamp as UTC hours and minutes'''
+    if timestamp is None:
+        return ""
+    return time.strftime("%H:%MZ", time.gmtime(timestamp))
+
+
+class SpotListView(wx.ListCtrl):
+    '''
+    Shows the spots as a virtual list. Only the rows on screen are ever drawn, so
+    it stays quick with thousands of spots. Click a column header to sort by it.
+    '''
+    # Column heading, width, text for a spot, sort key for a spot
+    COLUMNS = [
+        ("Activator", 120, lambda x: x.activator, lambda x: x.activator),
+        ("Park", 100, lambda x: x.park, lambda x: x.park),
+        ("Freq", 100, lambda x: formatFreq(x.frequency), lambda x: x.frequency),
+        ("Mode", 60, lambda x: x.mode.value if x.mode else "", lambda x: x.mode.value if x.mode else ""),
+        ("Band", 60, lambda x: x.band.name.split("_")[1] + "m" if x.band else "",
+         lambda x: x.band.value[0] if x.band else 0),
+        ("Spotted", 80, lambda x: formatSpotTime(x.timestamp), lambda x: x.timestamp or 0),
+    ]
+
+    def __init__(self, parent):
+        super().__init__(parent, style=wx.LC_REPORT|wx.LC_VIRTUAL|wx.LC_SINGLE_SEL)
+        for i, (heading, width, _, _) in enumerate(self.COLUMNS):
+            self.InsertColumn(i, heading, width=width)
+        self.source = []
+        # What's on screen, in display order, and where each one is
+        self.spots = []
+        self.rows = {}
+        self.sort_column = None
+        self.sort_ascending = True
+        self.active = None
+        try:
+            self.active_attr = wx.ItemAttr(SpotWidget.ACTIVE_FG, SpotWidget.ACTIVE_BG, wx.NullFont)
+        except AttributeError:
+            # Older versions of wxPython (<4.1) call it ListItemAttr
+            self.active_attr = wx.ListItemAttr(SpotWidget.ACTIVE_FG, SpotWidget.ACTIVE_BG, wx.NullFont)
+        self.Bind(wx.EVT_LIST_COL_CLICK, self.OnColumnClick)
+
+    def SetSnapshot(self, spots, dedup_key):
+        '''Called with every spot when a new snapshot arrives. We only need what's shown.'''
+
+    def ShowSpots(self, spots, dedup_key):
+        '''Shows these spots, in this order (unless we're sorted by a column)'''
+        self.active = None
+        self.source = spots
+        self.applySort()
+
+    def applySort(self):
+        if self.sort_column is None:
+            self.spots = list(self.source)
+        else:
+            self.spots = sorted(self.source, key=self.COLUMNS[self.sort_column][3],
+                                reverse=not self.sort_ascending)
+        self.rows = {spot: row for row, spot in enumerate(self.spots)}
+        self.SetItemCount(len(self.spots))
+        self.Refresh()
+
+    def OnColumnClick(self, event):
+        column = event.GetColumn()
+        if column == self.sort_column:
+            self.sort_ascending = not self.sort_ascending
+        else:
+            self.sort_column = column
+            self.sort_ascending = True
+        self.applySort()
+        if self.active is not None:
+            self.EnsureVisible(self.rows[self.active])
+
+    def SetActive(self, spot):
+        '''Highlights the spot we're tuned to (None for none)'''
+        previous = self.rows.get(self.active)
+        self.active = spot if spot in self.rows else None
+        if previous is not None:
+            self.RefreshItem(previous)
+        if self.active is not None:
+            row = self.rows[self.active]
+            self.RefreshItem(row)
+            self.EnsureVisible(row)
+
+    def OnGetItemText(self, item, column):
+        return self.COLUMNS[column][2](self.spots[item])
+
+    def OnGetItemAttr(self, item):
+        return self.active_attr if self.spots[item] is self.active else None
 
 
 class MainAppFrame(wx.Frame):
@@ -131,8 +371,9 @@ class MainAppFrame(wx.Frame):
         # ensure the parent's __init__ is called
         super(MainAppFrame, self).__init__(*args, **kw)
 
-        # Rig object
+        # Rig object, and what tunes it as we scan
         self.rig = None
+        self.tuner = scan.RigTuner(None)
 
         # Initialize SpotWidget colors after wx is initialized
         SpotWidget.initColors()
@@ -152,16 +393,15 @@ class MainAppFrame(wx.Frame):
         vbox = wx.BoxSizer(wx.VERTICAL)
         self.pnl.SetSizer(vbox)
 
-        # This holds our spots
-        self.sizer_spots = wx.WrapSizer(orient=wx.HORIZONTAL)
-        # Put it in a scrolled window so the spots can be scrolled
-        # TODO: Scrolling doesn't work right when the contents shrink
-        self.scrpanel = wx.ScrolledWindow(self.pnl, style=wx.VSCROLL)
-        self.scrpanel.SetScrollRate(10, 10)
-        self.scrpanel.SetSizer(self.sizer_spots)
+        # The spots, either as cards or as a list. Only one is shown at a time.
+        self.card_view = SpotCardView(self.pnl)
+        self.list_view = SpotListView(self.pnl)
+        self.list_view.Hide()
+        self.view = self.card_view
 
         # Add to our top-level sizer
-        vbox.Add(self.scrpanel, 1, flag=wx.EXPAND|wx.LEFT|wx.RIGHT|wx.TOP, border=10)
+        vbox.Add(self.card_view, 1, flag=wx.EXPAND|wx.LEFT|wx.RIGHT|wx.TOP, border=10)
+        vbox.Add(self.list_view, 1, flag=wx.EXPAND|wx.LEFT|wx.RIGHT|wx.TOP, border=10)
 
         # Line for seperation
         vbox.Add(wx.StaticLine(self.pnl), 0, wx.ALL|wx.EXPAND, 5)
@@ -177,15 +417,47 @@ class MainAppFrame(wx.Frame):
         # We're done with the GUI stuff! Here's some business logic!
         # Timer that we'll use for scanning
         self.timer = wx.Timer(self)
-        self.Bind(wx.EVT_TIMER, self.nextSpot)
-        # Initialize the POTA spot controller and load the current spots
+        self.Bind(wx.EVT_TIMER, self.nextSpot, self.timer)
+        # And one for reading the S-meter while we listen to a spot
+        self.listen_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.OnListen, self.listen_timer)
+        # Decides when a spot is quiet enough to skip, and what we've heard on
+        # the spot we're on (hop tells readings for old spots apart)
+        self.dwell = scan.AdaptiveDwell()
+        self.hop = 0
+        self.tuned_at = None
+        self.readings = []
+        # Initialize the POTA spot controller
         self.pc = pota.PotaSpotController()
-        self.pc.refresh()
-        ''' This is used to track the active spot during span'''
-        self.current_spot = None
-        self.OnSpotRedraw(None)
+        ''' The spots we show, in order '''
+        self.spots = []
+        ''' The spots we scan through and where we are. It keeps our place across redraws. '''
+        self.rotation = scan.ScanRotation(order=ORDER_STRINGS_TO_ORDERS[self.combo_order.GetValue()])
         '''Are we currently scanning?'''
         self.scan_active = False
+        # Keeps the spots fresh once we're up. The scheduler works out how often.
+        self.scheduler = pota.RefreshScheduler(
+            self.pc, lambda future: wx.CallAfter(self.OnSpotsFetched, future))
+        # Everything else about the spots waits until the window is up
+        wx.CallAfter(self.StartSpots)
+
+    def StartSpots(self):
+        '''Loads the spots, once the window is showing'''
+        if not self:
+            return
+        # Start with the spots from last time, so there's something to look at
+        # straight away, online or not
+        cached = self.pc.loadCache()
+        if cached is not None:
+            self.view.SetSnapshot(self.pc.spots, self.pc.dedup_key)
+        self.OnSpotRedraw(None)
+        # Load the current spots in the background - they appear when they arrive
+        self.RefreshSpots()
+        if cached is not None:
+            self.SetStatusText("Updating " + str(len(cached)) + " spots from " +
+                               time.strftime("%H:%M", time.localtime(cached.fetched_at)) + "...")
+        self.scheduler.record(self.pc.spots)
+        self.OnAutoRefresh(None)
 
 
     def radioSection(self, parent):
@@ -216,6 +488,17 @@ class MainAppFrame(wx.Frame):
         hbox_radio.Add(self.spin_interval, proportion=0, flag=wx.ALL, border=5)
         self.Bind(wx.EVT_SPINCTRL, self.OnIntervalSpin, self.spin_interval)
 
+        # Load the next spot into VFO B while we listen on A, and hop with a swap
+        self.check_dual_vfo = wx.CheckBox(parent, label="Pre-tune VFO B")
+        self.check_dual_vfo.SetToolTip("Load the next spot into VFO B ahead of time, so hops are a quick A/B swap")
+        hbox_radio.Add(self.check_dual_vfo, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL|wx.ALL, border=5)
+        self.Bind(wx.EVT_CHECKBOX, self.OnDualVfo, self.check_dual_vfo)
+
+        # Move on early from spots where nobody's transmitting
+        self.check_skip_quiet = wx.CheckBox(parent, label="Skip quiet spots")
+        self.check_skip_quiet.SetToolTip("Listen to the S-meter after tuning, and move on early if it's quiet")
+        hbox_radio.Add(self.check_skip_quiet, proportion=0, flag=wx.ALIGN_CENTER_VERTICAL|wx.ALL, border=5)
+
         # And now, our scan button
         self.btn_scan = wx.Button(parent, label=SCAN_START_LABEL)
         self.btn_scan.Disable() # Disabled until we connect
@@ -241,6 +524,11 @@ class MainAppFrame(wx.Frame):
         # label
         exitItem = fileMenu.Append(wx.ID_EXIT)
 
+        # A view menu to pick how the spots are shown
+        viewMenu = wx.Menu()
+        cardsItem = viewMenu.AppendRadioItem(wx.ID_ANY, VIEW_CARDS_LABEL)
+        listItem = viewMenu.AppendRadioItem(wx.ID_ANY, VIEW_LIST_LABEL)
+
         # Now a help menu for the about item
         helpMenu = wx.Menu()
         aboutItem = helpMenu.Append(wx.ID_ABOUT)
@@ -251,6 +539,7 @@ class MainAppFrame(wx.Frame):
         # triggered from the keyboard.
         menuBar = wx.MenuBar()
         menuBar.Append(fileMenu, "&File")
+        menuBar.Append(viewMenu, "&View")
         menuBar.Append(helpMenu, "&Help")
 
         # Give the menu bar to the frame
@@ -260,7 +549,10 @@ class MainAppFrame(wx.Frame):
         # each of the menu items. That means that when that menu item is
         # activated then the associated handler function will be called.
         self.Bind(wx.EVT_MENU, self.OnExit,  exitItem)
+        self.Bind(wx.EVT_CLOSE, self.OnClose)
         self.Bind(wx.EVT_MENU, self.OnAbout, aboutItem)
+        self.Bind(wx.EVT_MENU, lambda event: self.ShowView(self.card_view), cardsItem)
+        self.Bind(wx.EVT_MENU, lambda event: self.ShowView(self.list_view), listItem)
 
     def makeToolbar(self):
         # TODO: Toolbars look like crap on Mac - make a hbox sizer instead
@@ -273,6 +565,11 @@ class MainAppFrame(wx.Frame):
 
         refresh = toolbar.AddTool(wx.ID_REFRESH, "Reload", refresh)
 
+        self.check_auto_refresh = wx.CheckBox(toolbar, label="Auto")
+        self.check_auto_refresh.SetValue(True)
+        toolbar.AddControl(self.check_auto_refresh, label="Auto Reload")
+        self.Bind(wx.EVT_CHECKBOX, self.OnAutoRefresh, self.check_auto_refresh)
+
         toolbar.AddSeparator()
 
         toolbar.AddControl(wx.StaticText( toolbar, wx.ID_ANY, "Mode:"))
@@ -285,6 +582,20 @@ class MainAppFrame(wx.Frame):
         self.combo_bands = wx.ComboBox(toolbar, value="ALL", style=wx.CB_READONLY, choices=list(BAND_STRINGS_TO_BANDS))
         toolbar.AddControl(self.combo_bands, label="Bands")
 
+        toolbar.AddSeparator()
+
+        toolbar.AddControl(wx.StaticText( toolbar, wx.ID_ANY, "Scan Order:"))
+        self.combo_order = wx.ComboBox(toolbar, value="By Band", style=wx.CB_READONLY, choices=list(ORDER_STRINGS_TO_ORDERS))
+        toolbar.AddControl(self.combo_order, label="Scan Order")
+        self.Bind(wx.EVT_COMBOBOX, self.OnScanOrder, self.combo_order)
+
+        toolbar.AddSeparator()
+
+        toolbar.AddControl(wx.StaticText( toolbar, wx.ID_ANY, "One Spot Per:"))
+        self.combo_dedup = wx.ComboBox(toolbar, value="Call", style=wx.CB_READONLY, choices=list(DEDUP_STRINGS_TO_KEYS))
+        toolbar.AddControl(self.combo_dedup, label="One Spot Per")
+        self.Bind(wx.EVT_COMBOBOX, self.OnDedup, self.combo_dedup)
+
         # All of these result in redrawing the spots
         self.Bind(wx.EVT_TOOL, self.OnSpotRedraw, refresh)
         self.Bind(wx.EVT_COMBOBOX, self.OnSpotRedraw, self.combo_bands)
@@ -292,31 +603,115 @@ class MainAppFrame(wx.Frame):
 
         toolbar.Realize()
 
+    def RefreshSpots(self):
+        '''Starts a background refresh of the spots. They're redrawn when it finishes.'''
+        self.SetStatusText("Loading spots...")
+        self.pc.refreshAsync(lambda future: wx.CallAfter(self.OnSpotsFetched, future))
+
+    def OnAutoRefresh(self, event):
+        '''Turns the automatic refresh on or off'''
+        if self.check_auto_refresh.GetValue():
+            self.scheduler.start()
+        else:
+            self.scheduler.stop()
+
+    def OnSpotsFetched(self, future):
+        '''Called on the GUI thread when a background refresh finishes'''
+        if not self:
+            return # The window closed while we were fetching
+        try:
+            spots = future.result()
+        except Exception as e:
+            self.SetStatusText("Unable to load spots: " + str(e))
+            return
+        if spots is None:
+            # Nothing changed upstream - leave everything as it is
+            self.SetStatusText("Spots up to date (" + str(len(self.pc.spots)) + " spots)")
+            return
+        spots = self.pc.setSpots(spots)
+        self.scheduler.record(self.pc.spots)
+        self.view.SetSnapshot(self.pc.spots, self.pc.dedup_key)
+        if spots.stale:
+            self.SetStatusText("Unable to reach POTA - showing " + str(len(spots)) + " spots from " +
+                               time.strftime("%H:%M", time.localtime(spots.fetched_at)))
+        else:
+            self.SetStatusText("Loaded " + str(len(spots)) + " spots")
+        self.OnSpotRedraw(None)
+
     def OnSpotRedraw(self, event):
-        self.resetScan()
-        # We only refresh on the refresh button
+        # We only refresh on the refresh button. The redraw happens once the new spots arrive.
         if event is not None and event.GetEventType() == wx.wxEVT_TOOL and event.GetId() == wx.ID_REFRESH:
-            self.pc.refresh()
-        # TODO: Stop Scan
-        self.sizer_spots.Clear(delete_windows=True)
+            self.RefreshSpots()
+            return
         band = BAND_STRINGS_TO_BANDS[self.combo_bands.GetValue()]
         mode = MODE_STRINGS_TO_MODES[self.combo_mode.GetValue()]
+        self.spots = self.pc.getSpots(mode=mode, band=band)
+        self.view.ShowSpots(self.spots, self.pc.dedup_key)
+
+        # The scan carries on from where it was, rather than starting over
+        previous = self.rotation.current
+        self.rotation.update(self.spots, self.pc.dedup_key)
+        current = self.rotation.current
+        self.view.SetActive(current)
+        if self.scan_active and current is not None and current != previous:
+            # Same activator, but they've moved - follow them
+            self.tuneTo(current)
+        elif self.scan_active:
+            # What's next may have changed
+            self.tuner.preload(self.rotation.peek())
+
+    def OnScanOrder(self, event):
+        '''Changes the order we scan in. We carry on from the spot we're on.'''
+        self.rotation.setOrder(ORDER_STRINGS_TO_ORDERS[self.combo_order.GetValue()])
+        if self.scan_active:
+            self.tuner.preload(self.rotation.peek())
+        cost = self.rotation.passCost()
+        if cost.hops:
+            self.SetStatusText("Scanning " + str(len(self.rotation)) + " spots, " +
+                               str(cost.band_changes) + " band changes a pass")
+
+    def OnDedup(self, event):
+        '''Changes which spots count as repeats, and redoes the spots to match'''
+        self.pc.setDedupKey(DEDUP_STRINGS_TO_KEYS[self.combo_dedup.GetValue()])
+        # The scheduler compares refreshes by dedup key
+        self.scheduler.record(self.pc.spots)
+        self.view.SetSnapshot(self.pc.spots, self.pc.dedup_key)
+        self.OnSpotRedraw(None)
+        # Repeats the old key dropped only come back with a fetch
+        self.RefreshSpots()
 
-        # Pass the rig instance to each SpotWidget
-        self.spots = list(map(lambda x: SpotWidget(self.scrpanel, x['activator'], 
-                                                  x['reference'], x['frequency'], 
-                                                  rig=self.rig),
-                          self.pc.getSpots(mode=mode, band=band)))
-
-        for spot in self.spots:
-            self.sizer_spots.Add(spot, 0, flag = wx.ALL, border=5)
-        self.scrpanel.Layout()
+    def ShowView(self, view):
+        '''Switches between the card and list views'''
+        if view is self.view:
+            return
+        self.view.Hide()
+        self.view = view
+        # The hidden view doesn't keep up, so catch it up now
+        view.SetSnapshot(self.pc.spots, self.pc.dedup_key)
+        view.ShowSpots(self.spots, self.pc.dedup_key)
+        view.SetActive(self.rotation.current)
+        view.Show()
+        self.pnl.Layout()
 
     def OnConnect(self, event):
         port = self.int_rigctl_port.GetValue()
-        self.rig = CAT("rigctld", "127.0.0.1", port) # type: ignore
+        # Connecting can take a while - do it on the CAT worker and hear back later
+        self.btn_connect.SetLabel("Connecting...")
+        self.btn_connect.Disable()
+        from cat_interface import CATWorker
+        self.rig = CATWorker("rigctld", "127.0.0.1", port, # type: ignore
+                             on_connect=lambda online: wx.CallAfter(self.OnRigConnected, online))
+        self.tuner.rig = self.rig
+        self.tuner.preset = None
+
+    def OnRigConnected(self, online):
         # Check if connection was successful
-        if not self.rig.online:
+        if not online:
+            self.rig.stop()
+            self.rig = None
+            self.tuner.rig = None
+            self.btn_connect.SetLabel("Connect")
+            self.btn_connect.Enable()
             msg = "Unable to open rig!\n\n"
             msg += "An error occurred: IO error "
             msg += "(wrong rigctld port or rigctld not running?)"
@@ -325,41 +720,64 @@ class MainAppFrame(wx.Frame):
             dlg.Destroy()
             return
 
-        # Success! Enable scan and disable ourselves
+        # Success! Enable scan (we stay disabled)
         self.btn_connect.SetLabel("Connected!")
-        self.btn_connect.Disable()
         self.btn_scan.Enable()
 
-        # Redraw spots to pass the rig to them
-        self.OnSpotRedraw(None)
-
-    def resetScan(self):
-        self.scan_active = False
-        self.timer.Stop()
-        self.btn_scan.SetLabel(SCAN_START_LABEL)
-        if (self.current_spot is not None):
-            self.current_spot.Reset()
-            self.current_spot = None
-
     def nextSpot(self, event):
         '''Function to move to the next spot'''
         # Find the next spot
-        # TODO: Test this with one spot
-        if (self.spots is None or len(self.spots) == 0):
+        next = self.rotation.advance()
+        if next is None:
             return # Bail if we have nothing
-        if (self.current_spot is not None):
-            i = self.spots.index(self.current_spot)
-            next = self.spots[(i+1) % len(self.spots)]
-            # Reset the current - do it here since we know it's not None
-            self.current_spot.Reset()
-        else:
-            # We haven't started scanning - grab the first
-            next = self.spots[0]
 
         # Go to the next spot
-        next.MakeActive()
-        # Update the state
-        self.current_spot = next
+        self.view.SetActive(next)
+        self.tuneTo(next)
+
+    def tuneTo(self, spot):
+        '''Tunes the rig (if we have one) to a spot'''
+        # The headless scanner tunes the same way
+        self.hop += 1
+        self.listen_timer.Stop()
+        upcoming = self.rotation.peek() if self.scan_active else None
+        if self.tuner.tune(spot, upcoming) and self.scan_active and self.check_skip_quiet.GetValue():
+            # Listen for a moment, and skip it if nobody's there
+            self.tuned_at = time.monotonic()
+            self.readings = []
+            self.listen_timer.StartOnce(int(self.dwell.sample_interval * 1000))
+
+    def OnDualVfo(self, event):
+        '''Turns pre-tuning VFO B on or off'''
+        self.tuner.dual_vfo = self.check_dual_vfo.GetValue()
+        self.tuner.preset = None
+        if self.scan_active:
+            self.tuner.preload(self.rotation.peek())
+
+    def OnListen(self, event):
+        '''Reads the S-meter, on the CAT worker. OnStrength gets the answer.'''
+        if self.rig is None:
+            return
+        hop = self.hop
+        self.rig.submit("get_strength", callback=lambda strength: wx.CallAfter(self.OnStrength, hop, strength))
+
+    def OnStrength(self, hop, strength):
+        '''Decides whether to stay on a spot, from what the S-meter says'''
+        if not self:
+            return # The window closed while we were reading it
+        spot = self.rotation.current
+        if hop != self.hop or not self.scan_active or spot is None:
+            return # We've moved on already
+        self.readings.append(strength)
+        verdict = self.dwell.verdict(spot, self.readings, time.monotonic() - self.tuned_at)
+        if verdict is scan.Dwell.LISTEN:
+            self.listen_timer.StartOnce(int(self.dwell.sample_interval * 1000))
+        elif verdict is scan.Dwell.MOVE_ON:
+            # Nobody there. Start the interval over for the next one.
+            self.nextSpot(None)
+            self.timer.Start(int(self.spin_interval.GetValue()) * 1000)
+        elif strength is not None:
+            self.SetStatusText(spot.activator + " is on the air (" + scan.formatStrength(strength) + ")")
 
     def ToggleScan(self, event):
         # Scan on
@@ -372,6 +790,7 @@ class MainAppFrame(wx.Frame):
         else:
             self.scan_active = False
             self.timer.Stop()
+            self.listen_timer.Stop()
             self.btn_scan.SetLabel(SCAN_START_LABEL)
 
     def OnIntervalSpin(self, event):
@@ -385,6 +804,12 @@ class MainAppFrame(wx.Frame):
         """Close the frame, terminating the application."""
         self.Close(True)
 
+    def OnClose(self, event):
+        """Stops refreshing spots on the way out, so nothing holds up the exit"""
+        self.scheduler.stop()
+        self.pc.close()
+        event.Skip()
+
     def OnAbout(self, event):
         """Display an About Dialog"""
         wx.MessageBox("POTAScan v" + APP_VERSION + " by WY2K",
@@ -392,10 +817,25 @@ class MainAppFrame(wx.Frame):
                       wx.OK|wx.ICON_INFORMATION)
 
 
+def exitOnFirstPaint(frame):
+    '''
+    For startup_bench.py: prints a line as soon as the window first paints, then
+    quits. The benchmark times how long it takes for the line to show up.
+    '''
+    def OnPaint(event):
+        event.Skip()
+        frame.pnl.Unbind(wx.EVT_PAINT, handler=OnPaint)
+        print(FIRST_PAINT_MARKER, flush=True)
+        wx.CallAfter(frame.Close, True)
+    frame.pnl.Bind(wx.EVT_PAINT, OnPaint)
+
+
 if __name__ == '__main__':
     # When this module is run (not imported) then create the app, the
     # frame, show it, and start the event loop.
     app = wx.App()
     frm = MainAppFrame(None, title='POTAScan v' + APP_VERSION)
+    if os.environ.get(STARTUP_BENCH_ENV):
+        exitOnFirstPaint(frm)
     frm.Show()
     app.MainLoop()
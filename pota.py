@@ -17,74 +17,732 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import requests
 import json
+import logging
+import threading
+import hashlib
+import collections
+import bisect
+import codecs
 import enum
+import random
+import time
+import copy
+import os
+import sys
+import tempfile
+import concurrent.futures
+
+# Band and Mode live with Spot now, but everyone knows them as pota.Band and pota.Mode
+from spot import Band, Mode, Spot, parseMode
 
 SPOT_URL="https://api.pota.app/spot/"
 
-# TODO FIXME: All this radio stuff needs to get moved out
-class Mode(enum.Enum):
-    SSB = "SSB"
-    CW = "CW"
-    # FT*, FM not supported
+logger = logging.getLogger("pota")
+
+# Bytes to read at a time when streaming the feed
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Seconds to wait for api.pota.app to accept a connection, and between reads
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 15
+# Most seconds a whole download may take, however slowly the bytes trickle in
+FETCH_DEADLINE = 30
+# Tries per fetch, and the backoff between them: base * 2^try, capped
+FETCH_ATTEMPTS = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+# Failed fetches in a row before we stop asking for a while, and for how long
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN = 60
+
+# Bump this whenever the snapshot cache layout changes - older files are ignored
+CACHE_FORMAT = 1
+CACHE_FILE = "spots.json"
+
+# Everything a fetch can fail with. requests is only imported when we first fetch
+# (it's slow to import), but all its errors are OSErrors. Bad bodies (an HTML
+# error page, say) are ValueErrors.
+FETCH_ERRORS = (OSError, ValueError)
+
+
+class FeedUnavailable(OSError):
+    """The circuit breaker is open - we're not asking api.pota.app right now"""
+
+
+class CircuitBreaker():
+    """
+    Stops us from calling a service that keeps failing.
+
+    After threshold failures in a row the breaker opens, and allow() says no
+    for cooldown seconds. Then one trial call is let through: if it works the
+    breaker closes, if not it opens again.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Whether to make a call now"""
+        return self.opened_at is None or time.monotonic() - self.opened_at >= self.cooldown
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.warning("Spot feed failed %d times in a row, backing off for %g seconds",
+                               self.failures, self.cooldown)
+            self.opened_at = time.monotonic()
+
+
+def isRetryable(error):
+    """Whether a failed fetch is worth trying again right away"""
+    import requests
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        status = error.response.status_code
+        return status >= 500 or status == 429
+    # Connection problems, timeouts and garbled bodies
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, ValueError))
+
+
+class DedupKey(enum.Enum):
+    """What makes two spots "the same" when we only keep the most recent one"""
+    # One spot per call. A club call in two parks, or someone on two bands, only
+    # shows once - but a bad spot won't persist, and a QSY doesn't leave a ghost.
+    ACTIVATOR = "activator"
+    # One spot per call per park
+    ACTIVATOR_PARK = "activator+park"
+    # One spot per call per frequency
+    ACTIVATOR_FREQUENCY = "activator+frequency"
+
+    def of(self, spot):
+        """The dedup key for a spot"""
+        if self is DedupKey.ACTIVATOR_PARK:
+            return (spot.activator, spot.park)
+        if self is DedupKey.ACTIVATOR_FREQUENCY:
+            return (spot.activator, spot.frequency)
+        return spot.activator
+
+
+def iterJsonArray(chunks):
+    """
+    Yields the elements of a JSON array as it streams in, given an iterable of
+    byte chunks. Each element is decoded as soon as it's complete, so the whole
+    body never has to be in memory. Raises ValueError if it's not a JSON array.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    # Where we are in the array: before the '[', before the first element or the
+    # ']', after an element, after a ',', or after the ']'
+    state = "open"
+    eof = False
+    chunks = iter(chunks)
+    while not eof:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            buffer += utf8.decode(b"", final=True)
+        else:
+            buffer += utf8.decode(chunk)
+
+        while pos < len(buffer):
+            char = buffer[pos]
+            if char in " \t\r\n":
+                pos += 1
+            elif state == "open":
+                if char != "[":
+                    raise ValueError("Expected a JSON array, got " + repr(buffer[pos:pos + 40]))
+                state = "first"
+                pos += 1
+            elif state in ("first", "after") and char == "]":
+                state = "closed"
+                pos += 1
+            elif state == "after":
+                if char != ",":
+                    raise ValueError("Expected ',' or ']' at " + repr(buffer[pos:pos + 40]))
+                state = "element"
+                pos += 1
+            elif state == "closed":
+                raise ValueError("Extra data after JSON array: " + repr(buffer[pos:pos + 40]))
+            else:
+                try:
+                    element, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    break # Wait for the rest of it
+                if (not eof and not isinstance(element, (dict, list, str))
+                        and (end == len(buffer) or buffer[end] not in " \t\r\n,]")):
+                    break # A number could still be going ("1.5" of "1.5e3")
+                yield element
+                state = "after"
+                pos = end
+        # Drop what we've consumed
+        buffer = buffer[pos:]
+        pos = 0
+
+    if state != "closed":
+        raise ValueError("JSON array was cut short")
+
+
+def ingestSpots(raw_spots, dedup_key=DedupKey.ACTIVATOR):
+    """
+    Turns raw POTA spots (an iterable, so it can be streaming) into a SpotIndex,
+    in one pass.
+
+    POTA includes more than one spot per call, if someone keeps getting spotted.
+    Just like the website, we only want the most recent - the one with the
+    highest spot ID for its dedup key.
+
+    ASSUMPTION: Spot ID is a monotonically incrementing ID
+    """
+    return dedupSpots(parseSpots(raw_spots), dedup_key)
+
+
+def parseSpots(raw_spots):
+    """Yields a Spot for each raw POTA spot, skipping the ones we can't use"""
+    for raw in raw_spots:
+        try:
+            yield Spot.fromPota(raw)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.debug("Skipping unusable spot %s: %s", raw, e)
+
+
+def dedupSpots(spots, dedup_key=DedupKey.ACTIVATOR):
+    """A SpotIndex of the most recent of spots for each dedup key"""
+    latest = {}
+    for spot in spots:
+        key = dedup_key.of(spot)
+        current = latest.get(key)
+        if current is None or spot.spot_id > current.spot_id:
+            latest[key] = spot
+    # Oldest first, like the feed has always been shown
+    return SpotIndex(sorted(latest.values(), key=lambda spot: spot.spot_id), dedup_key)
+
+# What changed between two spot lists, by dedup key. added and changed hold the
+# new spots, removed holds the keys that are gone.
+SpotDelta = collections.namedtuple("SpotDelta", ["added", "removed", "changed"])
+
+
+def diffSpots(old, new, dedup_key=DedupKey.ACTIVATOR):
+    """
+    Works out what it takes to go from one (filtered) spot list to another, so a
+    view can patch itself instead of starting over. Spots are matched by their
+    dedup key - there's at most one spot per key after dedup.
+    """
+    old_by_key = {dedup_key.of(spot): spot for spot in old}
+    new_keys = set()
+    added = []
+    changed = []
+    for spot in new:
+        key = dedup_key.of(spot)
+        new_keys.add(key)
+        previous = old_by_key.get(key)
+        if previous is None:
+            added.append(spot)
+        elif previous != spot:
+            changed.append(spot)
+    removed = [key for key in old_by_key if key not in new_keys]
+    return SpotDelta(added, removed, changed)
+
+
+class SpotIndex():
+    """
+    An immutable snapshot of the spots, indexed for filtering.
+
+    The spots are kept sorted by frequency, overall and split up by mode, so a
+    band query is a bisect and a slice rather than a pass over everything. Query
+    results are memoized - a snapshot never changes, so (version, mode, band)
+    always gives the same answer.
+
+    dedup_key is what the spots were deduped by.
+    """
+
+    def __init__(self, spots, dedup_key=DedupKey.ACTIVATOR) -> None:
+        self.spots = spots
+        self.dedup_key = dedup_key
+        # Bumped by PotaSpotController each time a new snapshot goes live
+        self.version = 0
+        # When we got these, and whether they're old news we're showing because
+        # the feed is down
+        self.fetched_at = time.time()
+        self.stale = False
+        self.cache = {}
+        # Mode (None for all modes) -> ([frequency], [(position, spot)]), both
+        # sorted by frequency
+        self.by_mode = {None: ([], [])}
+        keyed = sorted(enumerate(spots), key=lambda entry: (entry[1].frequency, entry[0]))
+        for position, spot in keyed:
+            freq = spot.frequency
+            # Spots in modes we don't parse only go in the all-modes bucket
+            for bucket in (None,) if spot.mode is None else (None, spot.mode):
+                freqs, entries = self.by_mode.setdefault(bucket, ([], []))
+                freqs.append(freq)
+                entries.append((position, spot))
+
+    def __len__(self):
+        return len(self.spots)
+
+    def markedStale(self):
+        """The same snapshot, flagged as stale"""
+        stale = copy.copy(self)
+        stale.cache = {}
+        stale.stale = True
+        return stale
+
+    def markedFresh(self):
+        """The same snapshot, as if it had just been fetched"""
+        fresh = copy.copy(self)
+        fresh.cache = {}
+        fresh.stale = False
+        fresh.fetched_at = time.time()
+        return fresh
+
+    def query(self, mode=None, band=None):
+        """Spots matching mode and band (either may be None), in feed order"""
+        key = (self.version, mode, band)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        if band is None and mode is None:
+            result = list(self.spots)
+        else:
+            freqs, entries = self.by_mode.get(mode, ([], []))
+            if band is None:
+                matches = entries
+            else:
+                # Bands are in kHz, spots in Hz
+                low = bisect.bisect_left(freqs, band.value[0] * 1000)
+                high = bisect.bisect_right(freqs, band.value[1] * 1000)
+                matches = entries[low:high]
+            # Back into the order the feed gave us
+            result = [spot for _, spot in sorted(matches, key=lambda entry: entry[0])]
+        self.cache[key] = result
+        return result
 
-class Band(enum.Enum):
+
+def defaultCacheDir():
+    """Where we keep the spot cache, going by the platform's conventions"""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "potascan")
+
+
+def saveSnapshot(index, path):
+    """
+    Writes a snapshot to disk atomically: it goes to a temporary file next to
+    path, which is then renamed over it, so a crash (or a second POTAScan) can
+    never leave a half-written cache behind.
+
+    Spots are stored as rows rather than objects, to keep the file small.
+    """
+    snapshot = {
+        "format": CACHE_FORMAT,
+        "fetched_at": index.fetched_at,
+        "dedup": index.dedup_key.value,
+        "spots": [[spot.spot_id, spot.frequency, spot.mode.value if spot.mode else None,
+                   spot.timestamp, spot.activator, spot.park] for spot in index.spots],
+    }
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".spots-", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def loadSnapshot(path):
     """
-    Frequency ranges for the bands. HF only, and I'm not trying to do band plans - the point is just to filter
-    Also, yes, I know, these are just US limits.
+    Reads back a snapshot written by saveSnapshot. Returns None if there isn't
+    one, it's in a different version of the format, or it can't be read.
     """
-    METERS_160 = (1800, 2000)
-    METERS_80 = (3500, 4000)
-    METERS_40 = (7000, 7300)
-    METERS_30 = (10100, 10150)
-    METERS_20 = (14000, 14350)
-    METERS_17 = (18068, 18168)
-    METERS_15 = (21000, 21450)
-    METERS_12 = (24890, 24990)
-    METERS_10 = (28000, 29700)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if not isinstance(snapshot, dict) or snapshot.get("format") != CACHE_FORMAT:
+            logger.info("Ignoring spot cache %s in an unknown format", path)
+            return None
+        spots = [Spot(spot_id, frequency, parseMode(mode), timestamp, activator, park)
+                 for spot_id, frequency, mode, timestamp, activator, park in snapshot["spots"]]
+        # Older snapshots didn't say, but they were all per activator
+        index = SpotIndex(spots, DedupKey(snapshot.get("dedup", DedupKey.ACTIVATOR.value)))
+        index.fetched_at = float(snapshot["fetched_at"])
+    except FileNotFoundError:
+        return None
+    except (OSError, KeyError, TypeError, ValueError) as e:
+        logger.warning("Ignoring unreadable spot cache %s: %s", path, e)
+        return None
+    return index
 
 
 class PotaSpotController():
 
-    def __init__(self) -> None:
-        self.spots = []
+    def __init__(self, cache_dir=None) -> None:
+        self.index = SpotIndex([])
+        self.spots = self.index.spots
+        # One pooled session, so repeat refreshes reuse the TLS connection to the
+        # API. It's made on the first fetch, to keep requests out of startup.
+        self.session = None
+        # Refreshes run one at a time, off the caller's thread. That's a daemon
+        # thread, so a fetch stuck on a slow server can't hold up exiting.
+        self.pending = None
+        self.lock = threading.Lock()
+        # What we know about the last response, so we can skip unchanged ones
+        self.etag = None
+        self.last_modified = None
+        self.content_hash = None
+        # Which spots count as repeats of each other
+        self.dedup_key = DedupKey.ACTIVATOR
+        # The last snapshot we got from the feed, to fall back on when it's down
+        self.last_good = None
+        # Whether the last fetch handed out stale spots
+        self.serving_stale = False
+        self.breaker = CircuitBreaker()
+        # Every good snapshot is saved here, so the next start has spots to show
+        # without waiting on the network
+        self.cache_path = os.path.join(cache_dir or defaultCacheDir(), CACHE_FILE)
+
+    def loadCache(self):
+        """
+        Puts up the spots saved by the last run, marked stale, until a refresh
+        replaces them. They're also what we fall back on if the refresh fails.
+        Returns the cached SpotIndex, or None if there wasn't a usable one.
+        """
+        index = loadSnapshot(self.cache_path)
+        if index is None:
+            return None
+        if self.last_good is None:
+            self.last_good = index
+        stale = index.markedStale()
+        self.setSpots(stale)
+        return stale
+
+    def saveCache(self, index):
+        """Saves a snapshot for next time. Failing to is logged, not raised."""
+        try:
+            saveSnapshot(index, self.cache_path)
+        except OSError as e:
+            logger.warning("Unable to save spot cache %s: %s", self.cache_path, e)
 
     def refresh(self):
-        resp = requests.get(SPOT_URL)
-        raw_spots = json.loads(resp.content)
-        # DEBUG MODE (Uncomment)
-        #raw_spots = json.loads(open("spots.json",'r').read())
-
-        # POTA includes more than one spot per call, if someone keeps getting spotted
-        # Just like the website, we only want the most recent.
-        #
-        # Note: If there is a call active in multiple parks (like a club call), we'll only
-        # see one. I'm OK with this - it means if there's a bad spot, it won't persist.
-        # Simillarly, if someone is on multiple frequencies, we'll also only show one.
-        # Again I'm OK with this - trying to show both will be bad if someone QSY's.
-        #
-        # The logic for this looks just like a phone interview question, I know.
-
-        # ASSUMPTION: Spot ID is a monotonically incrementing ID
-        raw_spots = sorted(raw_spots, key=lambda spot: spot["spotId"])
-        calls = set()
-        deduped_spots = []
-        for spot in raw_spots:
-            if not spot["activator"] in calls:
-                deduped_spots.append(spot)
-                calls.add(spot["activator"])
-        self.spots = deduped_spots
+        """Fetches the current spots, blocking until done"""
+        index = self.fetch()
+        if index is not None:
+            self.setSpots(index)
+
+    def refreshAsync(self, callback):
+        """
+        Fetches the current spots in the background. Returns a Future of the new
+        SpotIndex (None if nothing changed since the last fetch) and calls
+        callback(future) from the background thread once it's done. Nothing
+        here changes until the caller hands the result to setSpots, so the
+        caller decides when (and on which thread) it lands.
+
+        If a refresh is already in flight, we don't start another one - the
+        callback is attached to the one that's running.
+        """
+        with self.lock:
+            if self.pending is None or self.pending.done():
+                self.pending = concurrent.futures.Future()
+                threading.Thread(target=self.runFetch, args=(self.pending,),
+                                 name="pota-refresh", daemon=True).start()
+            future = self.pending
+        future.add_done_callback(callback)
+        return future
+
+    def runFetch(self, future):
+        """fetch(), with the outcome going to future"""
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = self.fetch()
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def close(self):
+        """
+        Lets go of the network. A refresh that's still running is abandoned -
+        it's on a daemon thread, so it won't keep the program from exiting.
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.pending.cancel()
+        if self.session is not None:
+            self.session.close()
+
+    def setSpots(self, index):
+        """
+        Replaces the current spots with the result of a refresh, deduped our
+        way if they weren't already. Returns the SpotIndex that went live.
+        """
+        index = self.rededup(index)
+        index.version = self.index.version + 1
+        self.index = index
+        self.spots = index.spots
+        return index
+
+    def setDedupKey(self, dedup_key):
+        """
+        Changes which spots count as repeats of each other, and redoes the
+        current spots to match as best we can (see rededup). The next fetch
+        parses the feed again, even if it hasn't changed, to finish the job.
+        Returns the SpotIndex that went live.
+        """
+        if dedup_key != self.dedup_key:
+            self.dedup_key = dedup_key
+            self.etag = None
+            self.last_modified = None
+            self.content_hash = None
+        return self.setSpots(self.index)
+
+    def rededup(self, index):
+        """
+        index, deduped by our dedup key. We only have the spots that survived
+        the old key, so a coarser key merges them properly, but a finer one
+        can't bring back the repeats already dropped - that takes a fetch.
+        """
+        if index.dedup_key == self.dedup_key:
+            return index
+        rebuilt = dedupSpots(index.spots, self.dedup_key)
+        rebuilt.fetched_at = index.fetched_at
+        rebuilt.stale = index.stale
+        return rebuilt
+
+    def fetch(self):
+        """
+        Downloads, dedups and indexes the current spots. Doesn't touch self.spots.
+
+        Returns None if the feed hasn't changed since the last fetch: either the
+        server answered our ETag / If-Modified-Since with a 304 (and we never
+        download the body), or, for when it ignores them, the body hashes the
+        same as last time. If what we returned last was stale, though, an
+        unchanged feed gives the last good snapshot back, no longer stale.
+
+        Each try is bounded in time, and failures that might be passing (timeouts,
+        5xx, a garbled body) are retried with capped exponential backoff. If the
+        feed still can't be had, or it's been failing so much the circuit
+        breaker is open, we return the last good snapshot marked stale. Errors
+        are only raised if we've never had a good one.
+        """
+        if not self.breaker.allow():
+            return self.serveStale(FeedUnavailable("Spot feed is failing, not retrying yet"))
+        try:
+            index = self.fetchWithRetries()
+        except FETCH_ERRORS as e:
+            self.breaker.failure()
+            return self.serveStale(e)
+        self.breaker.success()
+        if index is None and self.serving_stale:
+            # The feed is back, and no different from when it went away
+            index = self.last_good.markedFresh()
+        self.serving_stale = False
+        if index is not None:
+            self.last_good = index
+            self.saveCache(index)
+        return index
+
+    def serveStale(self, error):
+        """The last good snapshot, marked stale - or error, if there isn't one"""
+        if self.last_good is None:
+            raise error
+        self.serving_stale = True
+        logger.warning("Spot feed unavailable (%s), using spots from %s", error,
+                       time.strftime("%H:%M:%S", time.localtime(self.last_good.fetched_at)))
+        return self.last_good.markedStale()
+
+    def fetchWithRetries(self):
+        for attempt in range(FETCH_ATTEMPTS):
+            try:
+                return self.fetchOnce()
+            except FETCH_ERRORS as e:
+                if attempt == FETCH_ATTEMPTS - 1 or not isRetryable(e):
+                    raise
+                # Full jitter, so retries from lots of clients spread out
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                logger.debug("Spot fetch failed (%s), retrying in %.1f seconds", e, delay)
+                time.sleep(delay)
+
+    def fetchOnce(self):
+        """One try at fetch, without the retries or fallback"""
+        import requests
+        if self.session is None:
+            self.session = requests.Session()
+        headers = {}
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        deadline = time.monotonic() + FETCH_DEADLINE
+        resp = self.session.get(SPOT_URL, headers=headers, stream=True,
+                                timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+        with resp:
+            if resp.status_code == 304:
+                return None
+            resp.raise_for_status()
+
+            # Hash the body as it streams through the parser, so it's only read
+            # once and never held in memory whole. An unchanged body still gets
+            # parsed on the way through, but nothing downstream is redone.
+            digest = hashlib.sha256()
+            def chunks():
+                for chunk in resp.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                    if time.monotonic() > deadline:
+                        raise requests.Timeout("Spot feed took more than %d seconds" % FETCH_DEADLINE)
+                    digest.update(chunk)
+                    yield chunk
+            dedup_key = self.dedup_key
+            index = ingestSpots(iterJsonArray(chunks()), dedup_key)
+            # DEBUG MODE (Uncomment)
+            #index = ingestSpots(json.load(open("spots.json",'r')), dedup_key)
+
+        content_hash = digest.digest()
+        if content_hash == self.content_hash:
+            return None
+        if dedup_key != self.dedup_key:
+            # The key changed under us. Don't let this count as up to date, or
+            # the next fetch could skip the body we need to redo it.
+            return index
+        # Only remember the validators once the body parsed - otherwise a bad
+        # response could get "not modified" forever
+        self.etag = resp.headers.get("ETag")
+        self.last_modified = resp.headers.get("Last-Modified")
+        self.content_hash = content_hash
+        return index
 
 
     def getSpots(self, mode=None, band=None):
         """
-        Gets a filtered list of spots. Valid modes
+        Gets a filtered list of Spots, in feed order. mode is a Mode and band a
+        Band; None means any. The list is shared with other callers - don't
+        modify it.
+        """
+        return self.index.query(mode, band)
+
+
+class RefreshScheduler():
+    """
+    Refreshes a PotaSpotController in the background, on its own schedule.
+
+    The interval adapts: when lots of spots are changing we poll more often, when
+    things are quiet (or the API is erroring) we back off. It never goes below
+    min_interval, so we can't hammer api.pota.app, and each wait is jittered so a
+    room full of POTAScans doesn't poll in lockstep.
+
+    callback(future) is called from a background thread after every refresh,
+    just like with refreshAsync. Whoever applies spots, from these refreshes or
+    any other way, should record() them, so the next refresh is compared with
+    what's actually in place.
+    """
+    # Defaults, in seconds
+    MIN_INTERVAL = 30
+    MAX_INTERVAL = 300
+    INITIAL_INTERVAL = 60
+    # How much of the wait is randomized, either way
+    JITTER = 0.1
+    # If at least this fraction of the spots changed, speed up
+    BUSY_FRACTION = 0.1
+
+    def __init__(self, controller, callback, min_interval=MIN_INTERVAL,
+                 max_interval=MAX_INTERVAL, initial_interval=INITIAL_INTERVAL) -> None:
+        self.controller = controller
+        self.callback = callback
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self.interval = min(max(initial_interval, self.min_interval), self.max_interval)
+        self.last_spots = controller.spots
+        self.stopped = None
+        self.thread = None
+
+    def start(self):
+        """Starts refreshing. The first refresh is one interval from now."""
+        if self.thread is not None:
+            return
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, args=(self.stopped,),
+                                       name="pota-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops refreshing. A refresh already in flight still finishes."""
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread = None
+
+    def nextDelay(self):
+        """
+        How long to wait before the next refresh: the interval, with jitter. The
+        jitter never takes it outside min_interval and max_interval.
+        """
+        jittered = self.interval * random.uniform(1 - self.JITTER, 1 + self.JITTER)
+        return min(max(jittered, self.min_interval), self.max_interval)
+
+    def record(self, spots):
+        """Notes the spots now in place, to compare the next refresh with"""
+        self.last_spots = spots
+
+    def adapt(self, future, baseline=None):
+        """
+        Adjusts the interval based on how a refresh went. baseline is the spots
+        in place when it started (last_spots if not given).
         """
-        # Yes, I probably got too clever here, but I'm already 90% of the way down the hole
-        mode_filter = (lambda x : True) if mode is None else (
-                lambda x : x['mode'] == mode.value)
-        band_filter = (lambda x : True) if band is None else (
-                lambda x : float(x['frequency']) >= band.value[0] and float(x['frequency']) <= band.value[1])
+        if baseline is None:
+            baseline = self.last_spots
+        try:
+            index = future.result()
+            if index is not None and index.stale:
+                raise FeedUnavailable("Got stale spots")
+        except Exception as e:
+            # Give the API room to recover
+            logger.debug("Scheduled refresh failed: %s", e)
+            self.interval *= 2
+        else:
+            if index is None:
+                changed = 0
+            else:
+                delta = diffSpots(baseline, index.spots, self.controller.dedup_key)
+                changed = (len(delta.added) + len(delta.removed) + len(delta.changed)) / max(1, len(index))
+                self.record(index.spots)
+            if changed >= self.BUSY_FRACTION:
+                self.interval /= 2
+            else:
+                self.interval *= 1.5
+        self.interval = min(max(self.interval, self.min_interval), self.max_interval)
+        logger.debug("Next refresh in about %.0f seconds", self.interval)
 
-        return list(filter(lambda x: mode_filter(x) and band_filter(x), self.spots))
+    def run(self, stopped):
+        while not stopped.wait(self.nextDelay()):
+            # The callback may record() these spots before we get to adapt()
+            baseline = self.last_spots
+            future = self.controller.refreshAsync(self.callback)
+            # Wait it out here, so refreshes never pile up
+            concurrent.futures.wait([future])
+            self.adapt(future, baseline)
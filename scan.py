@@ -0,0 +1,956 @@
+"""
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import collections
+import enum
+import json
+import logging
+import queue
+import statistics
+import sys
+import threading
+import time
+
+import pota
+from pota import DedupKey
+from spot import Band, parseMode
+
+logger = logging.getLogger("scan")
+
+# Seconds on each spot, unless told otherwise
+DEFAULT_SCAN_INTERVAL = 5
+
+# Tells ScanEngine.run() to return
+STOP = object()
+
+
+class ScanOrder(enum.Enum):
+    """
+    What order ScanRotation goes through the spots in. Anything else with an
+    arrange(spots) method that returns them as a new list will do as well.
+    """
+    # The order the feed gives them (oldest spot first), like the spot list
+    FEED = "feed"
+    # Up through the frequencies. The bands don't overlap, so this is also
+    # grouped by band: one band change per band per pass, the fewest there can
+    # be, and short hops within each one.
+    FREQUENCY = "frequency"
+
+    def arrange(self, spots):
+        if self is ScanOrder.FREQUENCY:
+            return sorted(spots, key=lambda spot: spot.frequency)
+        return list(spots)
+
+
+class HopCost():
+    """
+    A rough model of how long a rig takes to get from one spot to another, in
+    seconds, so scan orders can be compared.
+    """
+    # Retuning within a band: a CAT round trip and the synthesizer settling
+    SAME_BAND = 0.2
+    # Changing band: band relays, filters and, usually, a tuner cycle
+    BAND_CHANGE = 3.0
+
+    def __init__(self, same_band=SAME_BAND, band_change=BAND_CHANGE) -> None:
+        self.same_band = same_band
+        self.band_change = band_change
+
+    def between(self, spot, next_spot):
+        """Estimated seconds to go from spot to next_spot"""
+        if spot.band == next_spot.band:
+            return self.same_band
+        return self.band_change
+
+
+# An estimate of one pass through a rotation: how many hops, how many of them
+# change band, and how many seconds all of it costs on top of the dwell
+PassCost = collections.namedtuple("PassCost", ["hops", "band_changes", "seconds"])
+
+
+def passCost(spots, hop_cost=None):
+    """Estimates one pass through spots, back round to the first one"""
+    hop_cost = hop_cost or HopCost()
+    if len(spots) < 2:
+        return PassCost(len(spots), 0, 0.0)
+    pairs = list(zip(spots, spots[1:] + spots[:1]))
+    return PassCost(len(pairs), sum(1 for spot, next_spot in pairs if spot.band != next_spot.band),
+                    sum(hop_cost.between(spot, next_spot) for spot, next_spot in pairs))
+
+
+class ScanRotation():
+    """
+    The order we scan spots in, and where we are in it.
+
+    order (a ScanOrder) decides the order. Spots are kept in a list with a dict
+    from dedup key to position, so finding the next spot is O(1). When the
+    spots change (a refresh, or a different filter) the position is kept by
+    key: we carry on from the same activator, and new spots just take their
+    place in the order. If the spot we were on is gone, we carry on from the
+    next one after it that's still around. If it moved on past that one (a
+    respot puts an activator last in FEED order), we stay on it but still go
+    to that one next, rather than jumping ahead with it.
+    """
+
+    def __init__(self, dedup_key=DedupKey.ACTIVATOR, order=ScanOrder.FEED) -> None:
+        self.dedup_key = dedup_key
+        self.order = order
+        self.spots = []
+        self.positions = {}
+        # The key of the spot we're on, or None if we haven't started
+        self.current_key = None
+        # False if the spot we were on went away and current_key is the one
+        # after it - then that's where advance() goes next
+        self.landed = False
+        # Where advance() goes next instead of the spot after ours, when ours
+        # moved past it
+        self.next_key = None
+
+    def __len__(self):
+        return len(self.spots)
+
+    @property
+    def current(self):
+        """The spot we're on, or None"""
+        if not self.landed:
+            return None
+        position = self.positions.get(self.current_key)
+        return None if position is None else self.spots[position]
+
+    def reset(self):
+        """Starts over from the first spot"""
+        self.current_key = None
+        self.landed = False
+        self.next_key = None
+
+    def update(self, spots, dedup_key=None):
+        """Replaces the spots, keeping our place"""
+        if dedup_key is not None and dedup_key != self.dedup_key:
+            # Keys from before mean nothing now
+            self.dedup_key = dedup_key
+            self.reset()
+        old_spots = self.spots
+        old_positions = self.positions
+        old_position = old_positions.get(self.current_key)
+        self.spots = self.order.arrange(spots)
+        self.positions = {self.dedup_key.of(spot): i for i, spot in enumerate(self.spots)}
+
+        if self.current_key is None:
+            return
+        if self.current_key not in self.positions:
+            # Where we were is gone - find the first spot after it that's still here
+            self.landed = False
+            self.next_key = None
+            self.current_key = self.survivor(old_spots, old_position)
+            return
+        if not self.landed:
+            return
+        if self.next_key is not None:
+            if self.next_key not in self.positions:
+                self.next_key = self.survivor(old_spots, old_positions.get(self.next_key), True)
+            return
+        following = self.survivor(old_spots, old_position)
+        if following is None:
+            return
+        if (old_positions[following] > old_position
+                and self.positions[following] < self.positions[self.current_key]):
+            # We moved on past the spot that was next
+            self.next_key = following
+
+    def survivor(self, old_spots, old_position, inclusive=False):
+        """
+        The key of the first of old_spots after old_position (or at it, if
+        inclusive) that's still here, other than the spot we're on
+        """
+        if old_position is None:
+            return None
+        for step in range(0 if inclusive else 1, len(old_spots)):
+            key = self.dedup_key.of(old_spots[(old_position + step) % len(old_spots)])
+            if key in self.positions and key != self.current_key:
+                return key
+        return None
+
+    def setOrder(self, order):
+        """Switches to a different order, keeping our place"""
+        self.order = order
+        self.update(self.spots)
+
+    def passCost(self, hop_cost=None):
+        """Estimates one pass through the spots in the current order"""
+        return passCost(self.spots, hop_cost)
+
+    def nextPosition(self):
+        """Where advance() will go, or None if there are no spots"""
+        if not self.spots:
+            return None
+        position = self.positions.get(self.current_key)
+        if position is None:
+            return 0
+        if self.landed and self.next_key is not None:
+            return self.positions[self.next_key]
+        if self.landed:
+            return (position + 1) % len(self.spots)
+        return position
+
+    def peek(self):
+        """The spot advance() will go to, without going there (None if there are no spots)"""
+        position = self.nextPosition()
+        return None if position is None else self.spots[position]
+
+    def advance(self):
+        """Moves to the next spot and returns it (None if there are no spots)"""
+        position = self.nextPosition()
+        if position is None:
+            return None
+        self.current_key = self.dedup_key.of(self.spots[position])
+        self.landed = True
+        self.next_key = None
+        return self.spots[position]
+
+
+def rigModeFor(spot):
+    """
+    The mode to put the rig in for a spot. At least for my icom, the auto mode
+    switching (USB/LSB) does not happen if the frequency is set via CAT - so
+    we set it explicitly.
+    """
+    return "USB" if spot.frequency > 10000000 else "LSB"
+
+
+def tuneRig(rig, spot):
+    """
+    Tunes a rig (a CATWorker) to a spot, if it's online. Frequency and mode go
+    to the rig together, in one round trip, on the CAT worker thread. A newer
+    tune replaces this one if it hasn't gone out yet. Returns whether we asked.
+    """
+    if rig is None or not rig.online:
+        return False
+    rig.tune(str(spot.frequency), rigModeFor(spot))
+    return True
+
+
+class RigTuner():
+    """
+    Tunes one rig (a CATWorker) through a scan.
+
+    With dual_vfo, the spot after the one we're on is loaded into VFO B while
+    we listen on A, and the hop to it is a single A/B swap. Rigs that are
+    slow to take a new frequency then change spots almost at once.
+    """
+
+    def __init__(self, rig, dual_vfo=False) -> None:
+        self.rig = rig
+        self.dual_vfo = dual_vfo
+        # The spot we've loaded into VFO B, if any
+        self.preset = None
+
+    def tune(self, spot, upcoming=None):
+        """
+        Tunes to spot - by swapping VFOs, if it's the one in B - and loads
+        upcoming into B for next time. Returns whether we asked the rig.
+        """
+        if self.dual_vfo and self.preset == spot and self.rig is not None and self.rig.online:
+            self.rig.swap()
+            tuned = True
+        else:
+            tuned = tuneRig(self.rig, spot)
+        self.preset = None
+        if tuned and upcoming != spot:
+            self.preload(upcoming)
+        return tuned
+
+    def preload(self, spot):
+        """Loads a spot into VFO B, if we're using it and it's not there already"""
+        if not self.dual_vfo or spot is None or spot == self.preset:
+            return
+        if self.rig is None or not self.rig.online:
+            return
+        self.preset = spot
+        self.rig.pretune(str(spot.frequency), rigModeFor(spot),
+                         callback=lambda loaded: self.preloaded(spot, loaded))
+
+    def preloaded(self, spot, loaded):
+        """
+        Called from the CAT worker thread once a preload has gone out. If VFO B
+        didn't take it, the hop there is a plain tune.
+        """
+        if not loaded and self.preset == spot:
+            logger.debug("Unable to load %s into VFO B", spot)
+            self.preset = None
+
+
+class SpotSplit(enum.Enum):
+    """How ScanEngine shares the spots out between several rigs"""
+    # Deal the spots out like cards, so every rig gets about as many
+    ROUND_ROBIN = "round-robin"
+    # Each band goes to one rig, so a rig only changes band when its bands do
+    BAND = "band"
+
+    def split(self, spots, rig_count, dedup_key, previous):
+        """
+        Splits spots into rig_count lists, one per rig, each in feed order.
+
+        previous maps what we assigned last time (a dedup key, or a band) to a
+        rig, and is updated in place. Things stay with the rig they were on
+        where they can, so a refresh doesn't reshuffle every rig's rotation.
+        """
+        if self is SpotSplit.BAND:
+            groups = collections.defaultdict(list)
+            for spot in spots:
+                groups[spot.band].append(spot)
+            # Keep last time's bands, then the biggest new ones go to the least loaded rigs
+            loads = [0] * rig_count
+            assignment = {}
+            for band in groups:
+                rig = previous.get(band)
+                if rig is not None and rig < rig_count:
+                    assignment[band] = rig
+                    loads[rig] += len(groups[band])
+            for band in sorted((band for band in groups if band not in assignment),
+                               key=lambda band: -len(groups[band])):
+                rig = loads.index(min(loads))
+                assignment[band] = rig
+                loads[rig] += len(groups[band])
+            choose = lambda spot: assignment[spot.band]
+        else:
+            # Nobody gets more than their share, even if it means moving a spot
+            quota = -(-len(spots) // rig_count)
+            loads = [0] * rig_count
+            assignment = {}
+            for spot in spots:
+                key = dedup_key.of(spot)
+                rig = previous.get(key)
+                if rig is not None and rig < rig_count and loads[rig] < quota:
+                    assignment[key] = rig
+                    loads[rig] += 1
+            for spot in spots:
+                key = dedup_key.of(spot)
+                if key not in assignment:
+                    rig = loads.index(min(loads))
+                    assignment[key] = rig
+                    loads[rig] += 1
+            choose = lambda spot: assignment[dedup_key.of(spot)]
+
+        previous.clear()
+        previous.update(assignment)
+        shares = [[] for _ in range(rig_count)]
+        for spot in spots:
+            shares[choose(spot)].append(spot)
+        return shares
+
+
+class Dwell(enum.Enum):
+    """What AdaptiveDwell makes of a spot so far"""
+    # Too soon to tell - keep listening
+    LISTEN = "listen"
+    # Someone's there (or we can't tell) - stay for the whole interval
+    HOLD = "hold"
+    # Nobody's there - move on without waiting out the interval
+    MOVE_ON = "move on"
+
+
+class AdaptiveDwell():
+    """
+    Cuts the dwell short on quiet spots. Most activators are between QSOs (or
+    QSYed) most of the time, so rather than sit out the whole interval on
+    every spot we listen to the S-meter for a moment after tuning, and move on
+    if there's nothing there.
+
+    A reading counts as a signal if it's at or above threshold, or margin dB
+    above the band's noise floor if that's higher. The noise floor is learned
+    per band from the spots that turn out quiet, so a noisy 40m doesn't look
+    like it's always busy. Rigs that can't read their S-meter always get the
+    full interval.
+    """
+    # Seconds to listen before calling a spot quiet, and between S-meter reads
+    LISTEN_TIME = 1.5
+    SAMPLE_INTERVAL = 0.25
+    # dB relative to S9. -36 is about S3.
+    THRESHOLD = -36
+    # How far over the noise floor a signal has to be, in dB
+    MARGIN = 10
+    # How quickly the noise floor follows new readings (0-1)
+    FLOOR_WEIGHT = 0.25
+
+    def __init__(self, listen_time=LISTEN_TIME, sample_interval=SAMPLE_INTERVAL,
+                 threshold=THRESHOLD, margin=MARGIN) -> None:
+        self.listen_time = listen_time
+        self.sample_interval = sample_interval
+        self.threshold = threshold
+        self.margin = margin
+        # Band -> noise floor, in dB relative to S9
+        self.noise_floor = {}
+
+    def thresholdFor(self, band):
+        """The reading that counts as a signal on a band"""
+        floor = self.noise_floor.get(band)
+        if floor is None:
+            return self.threshold
+        return max(self.threshold, floor + self.margin)
+
+    def verdict(self, spot, readings, listened):
+        """
+        Decides what to do about a spot, given the S-meter readings (None for
+        ones that failed) since we tuned to it listened seconds ago.
+        """
+        heard = [reading for reading in readings if reading is not None]
+        if not heard:
+            # No S-meter - we can't tell, so don't skip anything
+            return Dwell.HOLD if readings else Dwell.LISTEN
+        if max(heard) >= self.thresholdFor(spot.band):
+            return Dwell.HOLD
+        if listened < self.listen_time:
+            return Dwell.LISTEN
+        self.learn(spot.band, heard)
+        return Dwell.MOVE_ON
+
+    def learn(self, band, readings):
+        """Folds the readings from a quiet spot into the band's noise floor"""
+        level = statistics.median(readings)
+        floor = self.noise_floor.get(band)
+        self.noise_floor[band] = level if floor is None else floor + self.FLOOR_WEIGHT * (level - floor)
+
+
+def formatStrength(strength):
+    """An S-meter reading (dB relative to S9) in S units, like S5 or S9+20"""
+    if strength >= 0:
+        return "S9+%d" % strength if strength else "S9"
+    return "S%d" % max(0, 9 + round(strength / 6))
+
+
+# An S-meter reading, on its way back from a rig's CAT worker to ScanEngine
+Reading = collections.namedtuple("Reading", ["rig", "hop", "strength"])
+
+
+class ScanEngine():
+    """
+    Scans rigs through the spots, with no GUI: the same rotation the window
+    uses, driven by a monotonic clock instead of a wx.Timer.
+
+    By default each rig sweeps up through its spots band by band (see
+    ScanOrder), so it spends its time on the spots rather than changing band.
+
+    With more than one rig, the spots are split between them (see SpotSplit)
+    and every rig has its own rotation through its share. Each hop tunes them
+    all at once - every rig has its own CAT worker, so they retune in parallel
+    - and each dwells on a different spot, so N rigs get through the list N
+    times as fast.
+
+    With dual_vfo, each rig loads its next spot into VFO B ahead of time and
+    hops with an A/B swap (see RigTuner).
+
+    Given a dwell (an AdaptiveDwell), each rig reads its S-meter after every
+    tune and moves on early from spots where nobody's transmitting. Rigs then
+    keep their own time, each hopping when its spot is done.
+
+    Everything happens on the thread that calls run(). New spots from a
+    refresh are handed over with spotsFetched(), which can be called from any
+    thread - they're queued and picked up between hops, as are S-meter
+    readings. on_tune(rig_number, spot), if given, is called (on the run()
+    thread) for every tune.
+    """
+
+    def __init__(self, controller, rigs, mode=None, band=None, interval=DEFAULT_SCAN_INTERVAL,
+                 split=SpotSplit.ROUND_ROBIN, order=ScanOrder.FREQUENCY, dwell=None,
+                 dual_vfo=False, on_tune=None, clock=time.monotonic) -> None:
+        self.controller = controller
+        self.rigs = list(rigs)
+        self.tuners = [RigTuner(rig, dual_vfo) for rig in self.rigs]
+        self.mode = mode
+        self.band = band
+        self.interval = interval
+        self.split = split
+        self.dwell = dwell
+        self.on_tune = on_tune
+        self.clock = clock
+        # A RefreshScheduler, if there is one, to record() the spots we take
+        self.scheduler = None
+        self.rotations = [ScanRotation(controller.dedup_key, order) for _ in self.rigs]
+        # What went to which rig last time, for SpotSplit
+        self.assignment = {}
+        self.spots = []
+        # Fetched spots (as futures), Readings and STOP, waiting for the run() thread
+        self.inbox = queue.Queue()
+        self.tunes = 0
+        # Per rig: when it next hops, and when it next reads the S-meter (None
+        # if it's not listening, or a reading is on its way)
+        self.next_hop = [self.clock()] * len(self.rigs)
+        self.next_sample = [None] * len(self.rigs)
+        # Per rig: which tune this is (so late readings can be told apart),
+        # when it was, and what we've heard since
+        self.hops = [0] * len(self.rigs)
+        self.tuned_at = [None] * len(self.rigs)
+        self.readings = [[] for _ in self.rigs]
+
+    def spotsFetched(self, future):
+        """Hands over a finished refresh. Safe to call from any thread."""
+        self.inbox.put(future)
+
+    def stop(self):
+        """Makes run() return. Safe to call from any thread."""
+        self.inbox.put(STOP)
+
+    def refilter(self):
+        """Picks the spots to scan out of the controller's, keeping each rig's place"""
+        self.spots = self.controller.getSpots(mode=self.mode, band=self.band)
+        dedup_key = self.controller.dedup_key
+        shares = self.split.split(self.spots, len(self.rigs), dedup_key, self.assignment)
+        for number, (rotation, share) in enumerate(zip(self.rotations, shares)):
+            previous = rotation.current
+            rotation.update(share, dedup_key)
+            current = rotation.current
+            if current is not None and current != previous:
+                # Same activator, but they've moved - follow them
+                self.tune(number, current)
+            elif current is not None:
+                # What's next may have changed
+                self.tuners[number].preload(rotation.peek())
+
+    def tune(self, number, spot):
+        tuned = self.tuners[number].tune(spot, self.rotations[number].peek())
+        if not tuned:
+            logger.warning("Rig %d is offline, not tuning to %s", number + 1, spot)
+        self.tunes += 1
+        self.hops[number] += 1
+        self.tuned_at[number] = self.clock()
+        self.readings[number] = []
+        self.next_sample[number] = None
+        if tuned and self.dwell is not None:
+            self.next_sample[number] = self.tuned_at[number] + self.dwell.sample_interval
+        if self.on_tune is not None:
+            self.on_tune(number, spot)
+
+    def hop(self, number):
+        """Moves a rig to its next spot and tunes it there. Returns the spot, or None."""
+        spot = self.rotations[number].advance()
+        if spot is not None:
+            self.tune(number, spot)
+        return spot
+
+    def step(self):
+        """Moves every rig to its next spot and tunes it there. Returns the spots."""
+        return [self.hop(number) for number in range(len(self.rigs))]
+
+    def sample(self, number):
+        """Asks a rig for its S-meter. The Reading turns up in the inbox."""
+        hop = self.hops[number]
+        self.rigs[number].submit("get_strength", callback=lambda strength:
+                                 self.inbox.put(Reading(number, hop, strength)))
+
+    def handleReading(self, reading):
+        number = reading.rig
+        spot = self.rotations[number].current
+        if reading.hop != self.hops[number] or spot is None:
+            return # From a spot we've already left
+        self.readings[number].append(reading.strength)
+        now = self.clock()
+        verdict = self.dwell.verdict(spot, self.readings[number], now - self.tuned_at[number])
+        if verdict is Dwell.LISTEN:
+            self.next_sample[number] = now + self.dwell.sample_interval
+        elif verdict is Dwell.MOVE_ON:
+            logger.debug("Rig %d: %s is quiet, moving on", number + 1, spot)
+            self.next_hop[number] = now
+        elif reading.strength is not None:
+            logger.info("Rig %d: %s is on the air (%s)", number + 1, spot,
+                        formatStrength(reading.strength))
+
+    def handleFetched(self, future):
+        try:
+            index = future.result()
+        except Exception as e:
+            logger.warning("Unable to load spots: %s", e)
+            return
+        if index is None:
+            return # Nothing changed upstream
+        index = self.controller.setSpots(index)
+        if self.scheduler is not None:
+            self.scheduler.record(self.controller.spots)
+        self.refilter()
+        logger.info("%s %d spots, %d to scan", "Stale:" if index.stale else "Loaded",
+                    len(index), len(self.spots))
+        self.logPassCost()
+
+    def logPassCost(self):
+        """Logs what a pass through the spots should cost in retuning, per rig"""
+        for number, rotation in enumerate(self.rotations):
+            cost = rotation.passCost()
+            if cost.hops:
+                logger.info("Rig %d: %d spots, %d band changes a pass, about %.1f seconds "
+                            "retuning per hop", number + 1, len(rotation), cost.band_changes,
+                            cost.seconds / cost.hops)
+
+    def run(self, max_tunes=None):
+        """
+        Scans until stop() is called (or after max_tunes tunes, if given). The
+        first hop is right away, then one every interval - or sooner, for
+        quiet spots, with a dwell.
+
+        Hops are scheduled against the monotonic clock rather than slept
+        between, so they don't drift by however long each one took. If we fall
+        a whole interval behind (the machine slept, say) we start counting again
+        from now instead of firing off the missed hops back to back.
+        """
+        self.refilter()
+        self.logPassCost()
+        self.next_hop = [self.clock()] * len(self.rigs)
+        while max_tunes is None or self.tunes < max_tunes:
+            wake = min(self.next_hop + [when for when in self.next_sample if when is not None])
+            try:
+                item = self.inbox.get(timeout=max(0, wake - self.clock()))
+            except queue.Empty:
+                item = None
+            if item is STOP:
+                return
+            if isinstance(item, Reading):
+                self.handleReading(item)
+            elif item is not None:
+                self.handleFetched(item)
+
+            now = self.clock()
+            for number in range(len(self.rigs)):
+                if self.next_sample[number] is not None and self.next_sample[number] <= now:
+                    self.next_sample[number] = None
+                    self.sample(number)
+                if self.next_hop[number] <= now:
+                    self.hop(number)
+                    self.next_hop[number] += self.interval
+                    if self.next_hop[number] <= now:
+                        self.next_hop[number] = now + self.interval
+
+
+# What's in a memory channel we haven't written (it's from before we started)
+UNKNOWN = object()
+
+# How one memory channel write (or clear) went, on its way back to MemoryScanner
+ChannelWrite = collections.namedtuple("ChannelWrite", ["rig", "channel", "ok"])
+
+# Seconds to wait for the rigs to stop scanning when we're done
+STOP_SCAN_TIMEOUT = 5
+
+
+class MemoryBank():
+    """
+    A block of a rig's memory channels, holding spots for the rig to scan
+    with its own memory scan.
+
+    We remember what we put in each channel, so when the spots change only
+    the channels that differ are rewritten. A spot that's still around stays
+    in the channel it's in, even if that's now out of order - every write is
+    CAT traffic, and at the rig's scan rate the order hardly matters.
+    """
+
+    def __init__(self, first, count) -> None:
+        self.channels = list(range(first, first + count))
+        # Channel -> (frequency, mode) we put there, or None if we emptied it
+        self.contents = dict.fromkeys(self.channels, UNKNOWN)
+
+    @staticmethod
+    def contentOf(spot):
+        """What goes in a channel for a spot"""
+        return (spot.frequency, rigModeFor(spot))
+
+    def __len__(self):
+        return sum(1 for content in self.contents.values() if content is not None)
+
+    def plan(self, spots):
+        """
+        Works out what to write to get the channels holding spots (as many as
+        fit, first come first served). Returns ([(channel, spot)] to write,
+        [channel] to clear), and assumes they'll all work - forget() the ones
+        that don't.
+        """
+        wanted = {}
+        for spot in spots:
+            if len(wanted) == len(self.channels):
+                break
+            wanted.setdefault(self.contentOf(spot), spot)
+        placed = set()
+        free = []
+        for channel in self.channels:
+            content = self.contents[channel]
+            if content in wanted and content not in placed:
+                placed.add(content)
+            else:
+                free.append(channel)
+
+        writes = []
+        for content, spot in wanted.items():
+            if content not in placed:
+                channel = free.pop(0)
+                writes.append((channel, spot))
+                self.contents[channel] = content
+        clears = [channel for channel in free if self.contents[channel] is not None]
+        for channel in clears:
+            self.contents[channel] = None
+        return writes, clears
+
+    def forget(self, channel):
+        """We don't know what's in a channel any more (say, a write failed)"""
+        self.contents[channel] = UNKNOWN
+
+
+class MemoryScanner(ScanEngine):
+    """
+    Leaves the scanning to the rigs themselves: each rig's share of the spots
+    (split and ordered as ScanEngine does it) goes into a block of its memory
+    channels, and the rig's own memory scan goes through them at hardware
+    speed, with no CAT traffic per spot.
+
+    When the spots change, only the channels that changed are rewritten, with
+    the rig's scan stopped while we do it.
+    """
+
+    def __init__(self, controller, rigs, first_channel, channel_count, **kw) -> None:
+        super().__init__(controller, rigs, **kw)
+        self.banks = [MemoryBank(first_channel, channel_count) for _ in self.rigs]
+        self.scanning = [False] * len(self.rigs)
+
+    def refilter(self):
+        """Picks the spots to scan, and reprograms the channels that need it"""
+        self.spots = self.controller.getSpots(mode=self.mode, band=self.band)
+        dedup_key = self.controller.dedup_key
+        shares = self.split.split(self.spots, len(self.rigs), dedup_key, self.assignment)
+        for number, (rotation, share) in enumerate(zip(self.rotations, shares)):
+            # The rotation just puts them in order
+            rotation.update(share, dedup_key)
+            writes, clears = self.banks[number].plan(rotation.spots)
+            if writes or clears or not self.scanning[number]:
+                self.program(number, writes, clears)
+
+    def program(self, number, writes, clears):
+        """Writes and clears channels on a rig, pausing its scan to do it"""
+        rig = self.rigs[number]
+        if self.scanning[number]:
+            rig.submit("stop_scan")
+            self.scanning[number] = False
+        for channel, spot in writes:
+            rig.submit("set_channel", channel, str(spot.frequency), rigModeFor(spot),
+                       callback=self.written(number, channel))
+        for channel in clears:
+            rig.submit("clear_channel", channel, callback=self.written(number, channel))
+        if len(self.banks[number]):
+            rig.submit("start_memory_scan", callback=lambda ok: ok or logger.warning(
+                "Rig %d didn't start its memory scan", number + 1))
+            self.scanning[number] = True
+        logger.info("Rig %d: %d channels written, %d cleared, %d in use", number + 1,
+                    len(writes), len(clears), len(self.banks[number]))
+
+    def written(self, number, channel):
+        """A callback for the CAT worker, to let run() know how a write went"""
+        return lambda ok: self.inbox.put(ChannelWrite(number, channel, ok))
+
+    def logPassCost(self):
+        # Hops are the rig's business now
+        pass
+
+    def run(self, max_tunes=None):
+        """Programs the rigs and keeps their channels up to date until stop() is called"""
+        self.refilter()
+        try:
+            while True:
+                item = self.inbox.get()
+                if item is STOP:
+                    return
+                if isinstance(item, ChannelWrite):
+                    if not item.ok:
+                        logger.warning("Rig %d: unable to program memory channel %d",
+                                       item.rig + 1, item.channel)
+                        self.banks[item.rig].forget(item.channel)
+                elif not isinstance(item, Reading):
+                    self.handleFetched(item)
+        finally:
+            self.stopScans()
+
+    def stopScans(self):
+        """Stops the rigs' scans, and waits (a while) for them to do it"""
+        stopped = []
+        for number, rig in enumerate(self.rigs):
+            if self.scanning[number]:
+                done = threading.Event()
+                rig.submit("stop_scan", callback=lambda ok, done=done: done.set())
+                stopped.append(done)
+                self.scanning[number] = False
+        deadline = time.monotonic() + STOP_SCAN_TIMEOUT
+        for done in stopped:
+            done.wait(max(0, deadline - time.monotonic()))
+
+
+def parseBand(value):
+    """A Band from something like '20', '20m' or 'all' (None)"""
+    value = value.lower().rstrip("m")
+    if value == "all":
+        return None
+    try:
+        return Band["METERS_" + value]
+    except KeyError:
+        raise argparse.ArgumentTypeError("no such band: " + value) from None
+
+
+def parseModeFilter(value):
+    """A Mode from 'SSB' or 'CW', or None for 'all'"""
+    if value.lower() == "all":
+        return None
+    mode = parseMode(value.upper())
+    if mode is None:
+        raise argparse.ArgumentTypeError("unsupported mode: " + value)
+    return mode
+
+
+def parseRig(value):
+    """A (host, port) from 'HOST:PORT' or just 'PORT'"""
+    host, _, port = value.rpartition(":")
+    try:
+        return (host or "127.0.0.1", int(port))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected HOST:PORT, got " + value) from None
+
+
+def parseChannels(value):
+    """A (first, count) block of memory channels from 'FIRST-LAST'"""
+    first, _, last = value.partition("-")
+    try:
+        first, last = int(first), int(last or first)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected FIRST-LAST, got " + value) from None
+    if last < first:
+        raise argparse.ArgumentTypeError("channels run backwards: " + value)
+    return (first, last - first + 1)
+
+
+def main(argv=None):
+    """Headless scanning: 'python scan.py --band 20 --mode CW'"""
+    parser = argparse.ArgumentParser(description="Scan rigs through POTA spots, without the GUI")
+    parser.add_argument("--band", type=parseBand, default=None, metavar="BAND",
+                        help="band to scan, like 20 or 40m (default all)")
+    parser.add_argument("--mode", type=parseModeFilter, default=None, metavar="MODE",
+                        help="SSB or CW (default all)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_SCAN_INTERVAL,
+                        help="seconds on each spot (default %(default)s)")
+    parser.add_argument("--host", default="127.0.0.1", help="rigctld host (default %(default)s)")
+    parser.add_argument("--port", type=int, default=4532, help="rigctld port (default %(default)s)")
+    parser.add_argument("--rig", type=parseRig, action="append", metavar="HOST:PORT",
+                        help="a rigctld to scan with. Give it once per rig to scan several at once "
+                             "(instead of --host and --port).")
+    parser.add_argument("--split", type=SpotSplit, default=SpotSplit.ROUND_ROBIN.value,
+                        choices=list(SpotSplit), metavar="|".join(split.value for split in SpotSplit),
+                        help="how to share the spots between rigs (default %(default)s)")
+    parser.add_argument("--order", type=ScanOrder, default=ScanOrder.FREQUENCY.value,
+                        choices=list(ScanOrder), metavar="|".join(order.value for order in ScanOrder),
+                        help="what order to scan the spots in: up through each band, or the order "
+                             "they were spotted (default %(default)s)")
+    parser.add_argument("--dedup", type=DedupKey, default=DedupKey.ACTIVATOR.value,
+                        choices=list(DedupKey), metavar="|".join(key.value for key in DedupKey),
+                        help="which spots count as repeats, of which only the latest is scanned "
+                             "(default %(default)s)")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="listen to the S-meter after tuning, and move on early from quiet spots")
+    parser.add_argument("--listen", type=float, default=AdaptiveDwell.LISTEN_TIME, metavar="SECONDS",
+                        help="with --adaptive, how long to listen before moving on (default %(default)s)")
+    parser.add_argument("--squelch", type=int, default=AdaptiveDwell.THRESHOLD, metavar="DB",
+                        help="with --adaptive, the S-meter reading that counts as a signal, in dB "
+                             "relative to S9 (default %(default)s, about S3)")
+    parser.add_argument("--dual-vfo", action="store_true",
+                        help="load the next spot into VFO B ahead of time, and hop with an A/B swap")
+    parser.add_argument("--memory", type=parseChannels, metavar="FIRST-LAST",
+                        help="program the spots into these memory channels and let the rig scan "
+                             "them itself (the channels are overwritten)")
+    parser.add_argument("--fake", action="store_true", help="use pretend rigs instead of rigctld")
+    parser.add_argument("--spots", metavar="FILE",
+                        help="scan spots from a saved POTA /spot/ response instead of fetching them")
+    parser.add_argument("--count", type=int, default=None,
+                        help="stop after this many tunes (default: run until interrupted)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log more")
+    args = parser.parse_args(argv)
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+    if args.memory and args.count is not None:
+        parser.error("--count doesn't apply to --memory (the rig does the tuning)")
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, stream=sys.stderr,
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    # Connect to them all at once - each CATWorker connects on its own thread
+    from cat_interface import CATWorker
+    addresses = args.rig or [(args.host, args.port)]
+    connecting = []
+    for host, port in addresses:
+        connected = threading.Event()
+        rig = CATWorker("fake" if args.fake else "rigctld", host, port,
+                        on_connect=lambda online, connected=connected: connected.set())
+        connecting.append((host, port, rig, connected))
+    rigs = []
+    labels = []
+    for host, port, rig, connected in connecting:
+        connected.wait()
+        if rig.online:
+            rigs.append(rig)
+            labels.append("%s:%d" % (host, port))
+        else:
+            logger.error("Unable to open rig at %s:%d (wrong rigctld port or rigctld not running?)",
+                         host, port)
+            rig.stop()
+    if not rigs:
+        return 1
+
+    def logTune(number, spot):
+        """Prints a tune event to stdout, one line per tune"""
+        print("%s TUNE %s %s %s %s kHz %s" % (
+            time.strftime("%Y-%m-%dT%H:%M:%S"), labels[number], spot.activator, spot.park,
+            spot.frequency / 1000, rigModeFor(spot)), flush=True)
+
+    dwell = None
+    if args.adaptive:
+        dwell = AdaptiveDwell(listen_time=args.listen, threshold=args.squelch)
+    controller = pota.PotaSpotController()
+    controller.setDedupKey(args.dedup)
+    if args.memory:
+        engine = MemoryScanner(controller, rigs, *args.memory, mode=args.mode, band=args.band,
+                               split=args.split, order=args.order)
+    else:
+        engine = ScanEngine(controller, rigs, mode=args.mode, band=args.band,
+                            interval=args.interval, split=args.split, order=args.order,
+                            dwell=dwell, dual_vfo=args.dual_vfo, on_tune=logTune)
+    scheduler = None
+    if args.spots:
+        with open(args.spots, "r", encoding="utf-8") as f:
+            controller.setSpots(pota.ingestSpots(json.load(f), controller.dedup_key))
+    else:
+        # Same as the GUI: last run's spots right away, fresh ones when they arrive
+        controller.loadCache()
+        scheduler = pota.RefreshScheduler(controller, engine.spotsFetched)
+        engine.scheduler = scheduler
+        controller.refreshAsync(engine.spotsFetched)
+        scheduler.start()
+
+    try:
+        engine.run(max_tunes=args.count)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        controller.close()
+        for rig in rigs:
+            rig.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
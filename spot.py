@@ -0,0 +1,129 @@
+"""
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import enum
+import sys
+
+
+class Mode(enum.Enum):
+    SSB = "SSB"
+    CW = "CW"
+    # FT*, FM not supported
+
+
+class Band(enum.Enum):
+    """
+    Frequency ranges for the bands, in kHz. HF only, and I'm not trying to do
+    band plans - the point is just to filter
+    Also, yes, I know, these are just US limits.
+    """
+    METERS_160 = (1800, 2000)
+    METERS_80 = (3500, 4000)
+    METERS_40 = (7000, 7300)
+    METERS_30 = (10100, 10150)
+    METERS_20 = (14000, 14350)
+    METERS_17 = (18068, 18168)
+    METERS_15 = (21000, 21450)
+    METERS_12 = (24890, 24990)
+    METERS_10 = (28000, 29700)
+
+    @classmethod
+    def forFrequency(cls, frequency):
+        """The band a frequency (in Hz) is in, or None"""
+        for band in cls:
+            if band.value[0] * 1000 <= frequency <= band.value[1] * 1000:
+                return band
+        return None
+
+
+def parseMode(mode):
+    """The Mode for a mode string, or None if we don't support it"""
+    try:
+        return Mode(mode)
+    except ValueError:
+        return None
+
+
+class Spot():
+    """
+    One spot, from whatever source. Only what we need is kept, already parsed:
+
+    spot_id - the source's ID for the spot. Bigger is newer.
+    frequency - in Hz, as an int
+    mode - a Mode, or None if it's one we don't support
+    band - a Band, or None if it's outside them
+    timestamp - when it was spotted, in seconds since the epoch (or None)
+    activator - the call sign
+    park - the park (or summit, etc.) reference
+
+    Spots are immutable, so they can be shared between threads and snapshots.
+    There can be a lot of them, hence __slots__, and the call sign and park
+    strings are interned since the same ones keep coming back.
+    """
+
+    __slots__ = ("spot_id", "frequency", "mode", "band", "timestamp", "activator", "park")
+
+    def __init__(self, spot_id, frequency, mode, timestamp, activator, park) -> None:
+        set_field = super().__setattr__
+        set_field("spot_id", spot_id)
+        set_field("frequency", frequency)
+        set_field("mode", mode)
+        set_field("band", Band.forFrequency(frequency))
+        set_field("timestamp", timestamp)
+        set_field("activator", sys.intern(activator))
+        set_field("park", sys.intern(park))
+
+    @classmethod
+    def fromPota(cls, raw):
+        """
+        Builds a Spot from one entry of the POTA /spot/ feed. Raises KeyError,
+        TypeError or ValueError if it's missing something we need.
+        """
+        # POTA frequencies are strings, in kHz
+        frequency = int(round(float(raw["frequency"]) * 1000))
+        try:
+            # POTA times are UTC, without saying so
+            timestamp = datetime.datetime.fromisoformat(raw["spotTime"]).replace(
+                tzinfo=datetime.timezone.utc).timestamp()
+        except (KeyError, TypeError, ValueError):
+            timestamp = None
+        return cls(int(raw["spotId"]), frequency, parseMode(raw.get("mode")), timestamp,
+                   raw["activator"], raw["reference"])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Spot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Spot is immutable")
+
+    def _fields(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if not isinstance(other, Spot):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def __repr__(self):
+        return (f"Spot({self.spot_id}, {self.activator} @ {self.park}, {self.frequency} Hz, "
+                f"{self.mode.value if self.mode else None})")
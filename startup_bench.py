@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+"""
+Measures how long POTAScan takes to start, so it can be tracked (and held to
+a budget) in CI.
+
+Two measurements:
+ - Imports: runs 'python -X importtime -c "import main"' and shows the slowest
+   imports, by cumulative time. It also checks that the modules we only load
+   on first use (requests, xmlrpc, cat_interface) stay out of startup.
+ - Time to first paint: starts main.py with POTASCAN_STARTUP_BENCH set, which
+   makes it print a marker when the window first paints, and times how long
+   that takes from launch.
+
+Both are run several times and the median is reported. On a headless machine
+the window needs a display, e.g. 'xvfb-run python startup_bench.py'. Exits
+with 1 if a budget given on the command line is blown, or a lazy module gets
+imported at startup.
+
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Must match main.py
+STARTUP_BENCH_ENV = "POTASCAN_STARTUP_BENCH"
+FIRST_PAINT_MARKER = "POTASCAN_FIRST_PAINT"
+
+# Modules that are only imported when first used, and shouldn't sneak back into startup
+LAZY_MODULES = ("requests", "urllib3", "xmlrpc.client", "cat_interface")
+
+# Seconds to wait for the window before giving up on a run
+PAINT_TIMEOUT = 60
+
+
+def importTimes(module):
+    """
+    Imports module in a fresh interpreter with -X importtime. Returns a dict of
+    module name -> (self, cumulative) microseconds.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                            cwd=HERE, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError("import %s failed:\n%s" % (module, result.stderr.strip()))
+    times = {}
+    for line in result.stderr.splitlines():
+        # import time:       337 |      93067 |   requests
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            times[fields[2].strip()] = (int(fields[0]), int(fields[1]))
+        except (IndexError, ValueError):
+            continue # The header
+    return times
+
+
+def timeToFirstPaint():
+    """Seconds from launching main.py to its window painting"""
+    env = dict(os.environ)
+    env[STARTUP_BENCH_ENV] = "1"
+    started = time.perf_counter()
+    child = subprocess.Popen([sys.executable, os.path.join(HERE, "main.py")], cwd=HERE, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    # Don't hang on a window that never shows up
+    timer = threading.Timer(PAINT_TIMEOUT, child.kill)
+    timer.start()
+    try:
+        for line in child.stdout:
+            if line.strip() == FIRST_PAINT_MARKER:
+                return time.perf_counter() - started
+        raise RuntimeError("main.py exited (%s) without painting" % child.wait())
+    finally:
+        timer.cancel()
+        # It closes itself, but don't count on it
+        child.kill()
+        child.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure POTAScan startup time")
+    parser.add_argument("--runs", type=int, default=5, help="times to measure each (default 5)")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to show (default 15)")
+    parser.add_argument("--module", default="main", help="module to time importing (default main)")
+    parser.add_argument("--import-budget", type=float, metavar="MS",
+                        help="fail if importing takes longer than this")
+    parser.add_argument("--paint-budget", type=float, metavar="MS",
+                        help="fail if the first paint takes longer than this")
+    parser.add_argument("--no-paint", action="store_true",
+                        help="only time the imports (no display needed)")
+    args = parser.parse_args()
+    failed = False
+
+    runs = [importTimes(args.module) for _ in range(args.runs)]
+    names = set().union(*runs)
+    median = {name: (statistics.median(run[name][0] for run in runs if name in run),
+                     statistics.median(run[name][1] for run in runs if name in run))
+              for name in names}
+    total_ms = median[args.module][1] / 1000
+    print("Importing %s: %.1f ms (median of %d)" % (args.module, total_ms, args.runs))
+    print("%10s %10s  %s" % ("self ms", "total ms", "module"))
+    for name, (own, cumulative) in sorted(median.items(), key=lambda item: -item[1][1])[:args.top]:
+        print("%10.1f %10.1f  %s" % (own / 1000, cumulative / 1000, name))
+
+    eager = [name for name in LAZY_MODULES if name in names]
+    if eager:
+        print("FAIL: imported at startup, but should wait until first use: " + ", ".join(eager))
+        failed = True
+    if args.import_budget is not None and total_ms > args.import_budget:
+        print("FAIL: imports took %.1f ms, budget is %.1f ms" % (total_ms, args.import_budget))
+        failed = True
+
+    if not args.no_paint:
+        paints = [timeToFirstPaint() * 1000 for _ in range(args.runs)]
+        paint_ms = statistics.median(paints)
+        print("Time to first paint: %.1f ms (median of %d, min %.1f, max %.1f)"
+              % (paint_ms, args.runs, min(paints), max(paints)))
+        if args.paint_budget is not None and paint_ms > args.paint_budget:
+            print("FAIL: first paint took %.1f ms, budget is %.1f ms" % (paint_ms, args.paint_budget))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
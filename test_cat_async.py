@@ -0,0 +1,168 @@
+"""
+Tests for cat_async.py, against a stand-in rigctld on a local asyncio server.
+Run with 'python -m pytest'.
+
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import gc
+import time
+import warnings
+
+from cat_async import AsyncCAT
+
+
+class StubRigctld():
+    """
+    Answers '|f' with the frequency of the moment, after delay seconds. With
+    hang_up, it drops the connection after every reply. connections counts
+    the connections it's had.
+    """
+
+    def __init__(self) -> None:
+        self.frequency = 14074000
+        self.delay = 0
+        self.hang_up = False
+        self.connections = 0
+        self.server = None
+        self.port = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.client, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def client(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                # Answer with what it was when asked, however late the answer
+                frequency = self.frequency
+                await asyncio.sleep(self.delay)
+                writer.write(f"get_freq:|Frequency: {frequency}|RPRT 0\n".encode())
+                await writer.drain()
+                if self.hang_up:
+                    break
+        except (OSError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def stop(self):
+        self.server.close()
+
+
+def runWithStub(test):
+    """Runs test(stub, rig) in a fresh event loop, with a stub and a rig talking to it"""
+    async def main():
+        stub = StubRigctld()
+        await stub.start()
+        rig = AsyncCAT("rigctld", "127.0.0.1", stub.port, timeout=0.5)
+        try:
+            await test(stub, rig)
+        finally:
+            await rig.close()
+            await stub.stop()
+    asyncio.run(main())
+
+
+def testTimeoutThenRecovers():
+    async def test(stub, rig):
+        assert await rig.get_vfo() == "14074000"
+        stub.delay = 2
+        started = time.monotonic()
+        assert await rig.get_vfo(timeout=0.2) == ""
+        assert time.monotonic() - started < 1
+        assert not rig.online
+        # The late reply is gone with the old connection
+        stub.delay = 0
+        stub.frequency = 7074000
+        assert await rig.get_vfo() == "7074000"
+        assert rig.online
+        assert stub.connections == 2
+    runWithStub(test)
+
+
+def testCancelledCommandDoesntLeaveItsReply():
+    async def test(stub, rig):
+        stub.delay = 0.3
+        task = asyncio.create_task(rig.get_vfo())
+        await asyncio.sleep(0.1)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        else:
+            raise AssertionError("get_vfo wasn't cancelled")
+        stub.delay = 0
+        stub.frequency = 7074000
+        assert await rig.get_vfo() == "7074000"
+        assert stub.connections == 2
+    runWithStub(test)
+
+
+def testCancelledWhileWaitingForTheConnection():
+    async def test(stub, rig):
+        stub.delay = 0.3
+        first = asyncio.create_task(rig.get_vfo())
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(rig.get_vfo())
+        await asyncio.sleep(0.05)
+        second.cancel()
+        assert await first == "14074000"
+        try:
+            await second
+        except asyncio.CancelledError:
+            pass
+        # Nothing was sent for the second one, so the connection is fine
+        assert stub.connections == 1
+
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        runWithStub(test)
+        gc.collect()
+    assert not [warning for warning in caught if issubclass(warning.category, RuntimeWarning)]
+
+
+def testTimeoutCoversWaitingForTheConnection():
+    async def test(stub, rig):
+        stub.delay = 1
+        first = asyncio.create_task(rig.get_vfo(timeout=2))
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        assert await rig.get_vfo(timeout=0.2) == ""
+        assert time.monotonic() - started < 0.5
+        assert await first == "14074000"
+    runWithStub(test)
+
+
+def testReconnectsAfterHangUp():
+    async def test(stub, rig):
+        stub.hang_up = True
+        assert await rig.connect()
+        assert await rig.get_vfo() == "14074000"
+        # The rig went away since - this one fails, and the next reconnects
+        assert await rig.get_vfo() == ""
+        stub.frequency = 7074000
+        assert await rig.get_vfo() == "7074000"
+        assert stub.connections == 2
+    runWithStub(test)
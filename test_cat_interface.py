@@ -0,0 +1,159 @@
+"""
+Tests for the rigctld side of cat_interface.py. Run with 'python -m pytest'.
+
+Most of them talk to a stand-in that records the commands and answers like
+rigctld does. The ones using the dummy_rig fixture run against Hamlib's dummy
+rig ('rigctld -m 1'), and are skipped if rigctld isn't installed.
+
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import re
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+import pytest
+
+from cat_interface import CAT
+
+
+class RecordingRigctld():
+    """
+    Answers extended ('|') rigctld commands, and keeps a list of them. Reads
+    find the rig on 7074000 LSB, and every set works.
+    """
+
+    def __init__(self) -> None:
+        self.commands = []
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.client, args=(connection,), daemon=True).start()
+
+    def client(self, connection):
+        with connection, connection.makefile("rb") as lines:
+            for line in lines:
+                command = line.decode().strip()
+                self.commands.append(command)
+                connection.sendall(self.reply(command).encode())
+
+    @staticmethod
+    def reply(command):
+        name = command.lstrip("|").split(" ")[0]
+        if name == "f":
+            return "get_freq:|Frequency: 7074000|RPRT 0\n"
+        if name == "m":
+            return "get_mode:|Mode: LSB|Passband: 2400|RPRT 0\n"
+        return f"{name}:|RPRT 0\n"
+
+    def close(self):
+        self.listener.close()
+
+
+@pytest.fixture
+def rigctld():
+    server = RecordingRigctld()
+    yield server
+    server.close()
+
+
+def testSetChannelSetsTheVfoBeforeSelectingTheChannel(rigctld):
+    rig = CAT("rigctld", "127.0.0.1", rigctld.port)
+    rigctld.commands.clear()
+    assert rig.set_channel(5, "14250000", "USB")
+    sets = [command for command in rigctld.commands if command.split(" ")[0] not in ("|f", "|m")]
+    assert sets == ["|V VFOA", "|V VFOA", "|F 14250000", "|M USB 0", "|E 5", "|G FROM_VFO",
+                    "|V VFOA", "|F 7074000", "|M LSB 2400"]
+
+    # VFO A is known now, so the next channel doesn't read it again
+    rigctld.commands.clear()
+    assert rig.set_channel(6, "14260000", "USB")
+    assert rigctld.commands == ["|V VFOA", "|F 14260000", "|M USB 0", "|E 6", "|G FROM_VFO",
+                                "|V VFOA", "|F 7074000", "|M LSB 2400"]
+
+
+def testClearChannelEndsOnVfoA(rigctld):
+    rig = CAT("rigctld", "127.0.0.1", rigctld.port)
+    rigctld.commands.clear()
+    assert rig.clear_channel(7)
+    assert rigctld.commands == ["|E 7", "|G MCL", "|V VFOA"]
+
+
+@pytest.fixture
+def dummy_rig():
+    if shutil.which("rigctld") is None:
+        pytest.skip("rigctld (Hamlib) isn't installed")
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    process = subprocess.Popen(["rigctld", "-m", "1", "-T", "127.0.0.1", "-t", str(port)])
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.1)
+    yield port
+    process.terminate()
+    process.wait()
+
+
+def rigctldCommand(port, command):
+    """One extended command on its own connection, returning the reply fields"""
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as connection:
+        connection.sendall(f"{command}\n".encode())
+        reply = b""
+        while b"RPRT" not in reply or not reply.endswith(b"\n"):
+            data = connection.recv(4096)
+            if not data:
+                break
+            reply += data
+    return reply.decode().strip().split("|")
+
+
+def testSetChannelOnHamlibDummyRig(dummy_rig):
+    rig = CAT("rigctld", "127.0.0.1", dummy_rig)
+    assert rig.batch([("set_vfo", "7074000"), ("set_mode", "LSB")]) == [True, True]
+    assert rig.set_channel(1, "14250000", "USB")
+    assert rig.set_channel(2, "21300000", "USB")
+
+    # VFO A is as we left it
+    assert rigctldCommand(dummy_rig, "|f")[1] == "Frequency: 7074000"
+    assert rigctldCommand(dummy_rig, "|m")[1] == "Mode: LSB"
+    # And the channels hold what we put there
+    for channel, frequency in ((1, "14250000"), (2, "21300000")):
+        fields = rigctldCommand(dummy_rig, f"|h {channel} 1")
+        assert re.search(rf"Freq:\s*{frequency}\b", " ".join(fields)), fields
+
+    assert rig.start_memory_scan()
+    assert rig.stop_scan()
+    assert rigctldCommand(dummy_rig, "|f")[1] == "Frequency: 7074000"
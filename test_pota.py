@@ -0,0 +1,284 @@
+"""
+Tests for pota.py. Run with 'python -m pytest'.
+
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import pota
+from pota import Band, DedupKey, Mode
+
+
+def rawSpot(spot_id, activator, frequency, mode, park="US-0001"):
+    """One entry of the POTA /spot/ feed (frequency in kHz, as a string)"""
+    return {"spotId": spot_id, "activator": activator, "frequency": str(frequency),
+            "mode": mode, "reference": park, "spotTime": "2025-01-01T12:00:00"}
+
+
+def testQueryUnparsedModeOnce():
+    # FT8 doesn't parse to a Mode, so the spot only belongs in the all-modes list
+    index = pota.ingestSpots([
+        rawSpot(1, "K1ABC", 3573, "FT8"),
+        rawSpot(2, "K2ABC", 3550, "CW"),
+        rawSpot(3, "K3ABC", 14074, "FT8"),
+    ])
+    assert [spot.activator for spot in index.query(None, Band.METERS_80)] == ["K1ABC", "K2ABC"]
+    assert [spot.activator for spot in index.query()] == ["K1ABC", "K2ABC", "K3ABC"]
+    assert [spot.activator for spot in index.query(Mode.CW, None)] == ["K2ABC"]
+    assert index.query(Mode.SSB, Band.METERS_80) == []
+
+
+def testIterJsonArraySplitAnywhere():
+    body = b'[1.5e3, -2, 0.25, true, null, "a,]b", {"k": [1, 2]}, 1E-2]'
+    expected = [1500.0, -2, 0.25, True, None, "a,]b", {"k": [1, 2]}, 0.01]
+    for split in range(len(body) + 1):
+        assert list(pota.iterJsonArray([body[:split], body[split:]])) == expected, split
+    assert list(pota.iterJsonArray([bytes([byte]) for byte in body])) == expected
+
+
+def testIterJsonArrayBadBody():
+    for body in (b"<html></html>", b"[1, 2", b"[1 2]", b"[1.5x]", b"[1] 2"):
+        try:
+            list(pota.iterJsonArray([body]))
+        except ValueError:
+            continue
+        raise AssertionError("parsed " + repr(body))
+
+
+def testSetDedupKeyMergesRightAway():
+    controller = pota.PotaSpotController(cache_dir="unused")
+    controller.setDedupKey(DedupKey.ACTIVATOR_PARK)
+    index = pota.ingestSpots([
+        rawSpot(1, "K1ABC", 14250, "SSB", park="US-0001"),
+        rawSpot(2, "K1ABC", 7200, "SSB", park="US-0002"),
+    ], DedupKey.ACTIVATOR_PARK)
+    controller.setSpots(index)
+    assert [spot.park for spot in controller.spots] == ["US-0001", "US-0002"]
+
+    controller.setDedupKey(DedupKey.ACTIVATOR)
+    assert [spot.park for spot in controller.spots] == ["US-0002"]
+    assert controller.index.dedup_key is DedupKey.ACTIVATOR
+    # A refresh deduped the old way is redone on its way in
+    assert [spot.park for spot in controller.setSpots(index).spots] == ["US-0002"]
+
+
+def testRefreshDelayStaysInBounds():
+    controller = pota.PotaSpotController(cache_dir="unused")
+    scheduler = pota.RefreshScheduler(controller, None, min_interval=30, max_interval=300,
+                                      initial_interval=30)
+    assert min(scheduler.nextDelay() for _ in range(1000)) >= 30
+    scheduler.interval = 300
+    assert max(scheduler.nextDelay() for _ in range(1000)) <= 300
+
+
+class FakeFeed():
+    """
+    A local stand-in for api.pota.app. Each GET takes the next of responses, a
+    (status, body, delay) tuple - the last one repeats. hits counts the GETs.
+    """
+
+    def __init__(self) -> None:
+        self.responses = []
+        self.hits = 0
+        feed = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body, delay = feed.responses[min(feed.hits, len(feed.responses) - 1)]
+                feed.hits += 1
+                time.sleep(delay)
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except OSError:
+                    pass # The client gave up on us
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.url = "http://127.0.0.1:%d/spot/" % self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+FEED = json.dumps([rawSpot(1, "K1ABC", 14250, "SSB"), rawSpot(2, "K2ABC", 7030, "CW")]).encode()
+HTML = b"<html><body>502 Bad Gateway</body></html>"
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    feed = FakeFeed()
+    monkeypatch.setattr(pota, "SPOT_URL", feed.url)
+    monkeypatch.setattr(pota, "READ_TIMEOUT", 0.3)
+    monkeypatch.setattr(pota, "BACKOFF_BASE", 0.01)
+    yield feed
+    feed.close()
+
+
+@pytest.fixture
+def controller(tmp_path):
+    controller = pota.PotaSpotController(cache_dir=str(tmp_path))
+    yield controller
+    controller.close()
+
+
+def testFetchRetriesSlowResponse(feed, controller):
+    feed.responses = [(200, FEED, 1.0), (200, FEED, 0)]
+    index = controller.fetch()
+    assert [spot.activator for spot in index.spots] == ["K1ABC", "K2ABC"]
+    assert not index.stale
+    assert feed.hits == 2
+
+
+def testFetchRetriesServerErrors(feed, controller):
+    feed.responses = [(503, b"", 0), (500, b"", 0), (200, FEED, 0)]
+    assert len(controller.fetch()) == 2
+    assert feed.hits == 3
+
+
+def testFetchDoesntRetryClientErrors(feed, controller):
+    import requests
+    feed.responses = [(404, b"", 0)]
+    with pytest.raises(requests.HTTPError):
+        controller.fetch()
+    assert feed.hits == 1
+
+
+def testFetchHtmlBodyWithoutCache(feed, controller):
+    # Nothing to fall back on, so the error comes through
+    feed.responses = [(200, HTML, 0)]
+    with pytest.raises(ValueError):
+        controller.fetch()
+    assert feed.hits == pota.FETCH_ATTEMPTS
+
+
+def testFetchServesStale(feed, controller):
+    feed.responses = [(200, FEED, 0), (502, HTML, 0)]
+    good = controller.fetch()
+    controller.setSpots(good)
+    stale = controller.fetch()
+    assert stale.stale
+    assert stale.spots == good.spots
+    assert stale.fetched_at == good.fetched_at
+
+
+def testFetchStaleFromDiskCache(feed, controller, tmp_path):
+    feed.responses = [(200, FEED, 0)]
+    controller.fetch()
+    # A new run, with the feed down
+    feed.responses = [(503, b"", 0)]
+    restarted = pota.PotaSpotController(cache_dir=str(tmp_path))
+    assert restarted.loadCache().stale
+    index = restarted.fetch()
+    assert index.stale
+    assert [spot.activator for spot in index.spots] == ["K1ABC", "K2ABC"]
+
+
+def testBreakerOpensAndRecovers(feed, controller, monkeypatch):
+    monkeypatch.setattr(pota, "FETCH_ATTEMPTS", 1)
+    controller.breaker = pota.CircuitBreaker(threshold=3, cooldown=0.5)
+    feed.responses = [(200, FEED, 0), (500, b"", 0)]
+    controller.fetch()
+    for _ in range(3):
+        assert controller.fetch().stale
+    assert controller.breaker.open
+    hits = feed.hits
+    # Open: we don't even ask
+    assert controller.fetch().stale
+    assert feed.hits == hits
+
+    time.sleep(0.6)
+    feed.responses = [(200, FEED, 0)]
+    feed.hits = 0
+    index = controller.fetch()
+    assert feed.hits == 1
+    assert not controller.breaker.open
+    # The feed didn't change while it was down, but the spots aren't stale any more
+    assert index is not None and not index.stale
+
+
+def testUnchangedFeedReturnsNone(feed, controller):
+    feed.responses = [(200, FEED, 0)]
+    assert controller.fetch() is not None
+    assert controller.fetch() is None
+    assert feed.hits == 2
+
+
+def testFeedIsParsedAsItStreams(feed, controller, monkeypatch):
+    monkeypatch.setattr(pota, "STREAM_CHUNK_SIZE", 16)
+    received = []
+    def chunksSeen(chunks):
+        for chunk in chunks:
+            received.append(chunk)
+            yield chunk
+    parse = pota.iterJsonArray
+    monkeypatch.setattr(pota, "iterJsonArray", lambda chunks: parse(chunksSeen(chunks)))
+    # Spots come out of the parser before the rest of the body has been read
+    ingest = pota.ingestSpots
+    progress = []
+    def ingestSpots(raw_spots, dedup_key):
+        def counted():
+            for raw in raw_spots:
+                progress.append(len(received))
+                yield raw
+        return ingest(counted(), dedup_key)
+    monkeypatch.setattr(pota, "ingestSpots", ingestSpots)
+    feed.responses = [(200, FEED, 0)]
+    assert len(controller.fetch()) == 2
+    assert progress[0] < len(received)
+
+
+def testFinerDedupKeyTakesEffectOnTheNextFetch(feed, controller):
+    feed.responses = [(200, json.dumps([
+        rawSpot(1, "K1ABC", 14250, "SSB", park="US-0001"),
+        rawSpot(2, "K1ABC", 7200, "SSB", park="US-0002"),
+    ]).encode(), 0)]
+    controller.setSpots(controller.fetch())
+    assert len(controller.spots) == 1
+    controller.setDedupKey(DedupKey.ACTIVATOR_PARK)
+    # Even though the feed hasn't changed
+    controller.setSpots(controller.fetch())
+    assert [spot.park for spot in controller.spots] == ["US-0001", "US-0002"]
+
+
+def testSchedulerComparesWithTheSpotsInPlace():
+    controller = pota.PotaSpotController(cache_dir="unused")
+    scheduler = pota.RefreshScheduler(controller, None, min_interval=10, max_interval=1000,
+                                      initial_interval=100)
+    spots = pota.ingestSpots([rawSpot(i, "K%dABC" % i, 14000 + i, "SSB") for i in range(1, 11)])
+    # A manual reload put these in place since the scheduler last looked
+    scheduler.record(spots.spots)
+    future = concurrent.futures.Future()
+    future.set_result(spots)
+    scheduler.adapt(future)
+    # Nothing new, so it slows down
+    assert scheduler.interval == 150
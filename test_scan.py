@@ -0,0 +1,357 @@
+"""
+Tests for scan.py. Run with 'python -m pytest'.
+
+This file is part of POTAScan
+
+Copyright (C) 2023-2025 Benjamin Seidenberg
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import collections
+import concurrent.futures
+import json
+import queue
+import threading
+import time
+
+import pytest
+
+import pota
+from cat_interface import CAT, CATWorker
+import scan
+from scan import AdaptiveDwell, Dwell, Reading, RigTuner, ScanEngine, ScanOrder, ScanRotation
+
+
+def rawSpot(spot_id, activator, frequency, mode="SSB", park="US-0001"):
+    """One entry of the POTA /spot/ feed (frequency in kHz, as a string)"""
+    return {"spotId": spot_id, "activator": activator, "frequency": str(frequency),
+            "mode": mode, "reference": park, "spotTime": "2025-01-01T12:00:00"}
+
+
+def spotsOf(*raw_spots):
+    return pota.ingestSpots(raw_spots).spots
+
+
+def activators(rotation, hops):
+    return [rotation.advance().activator for _ in range(hops)]
+
+
+def testRotationKeepsItsPlaceAcrossRefreshes():
+    rotation = ScanRotation()
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 14260),
+                            rawSpot(3, "K3ABC", 14270)))
+    assert activators(rotation, 2) == ["K1ABC", "K2ABC"]
+    # K2ABC went QRT, and somebody new was spotted
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(3, "K3ABC", 14270),
+                            rawSpot(4, "K4ABC", 14280)))
+    assert rotation.current is None
+    assert activators(rotation, 3) == ["K3ABC", "K4ABC", "K1ABC"]
+
+
+def testRespotInFeedOrderDoesntSkipAhead():
+    rotation = ScanRotation(order=ScanOrder.FEED)
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 14260),
+                            rawSpot(3, "K3ABC", 14270), rawSpot(4, "K4ABC", 14280)))
+    assert activators(rotation, 2) == ["K1ABC", "K2ABC"]
+    # K2ABC is respotted on a new frequency, which puts it last
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(3, "K3ABC", 14270),
+                            rawSpot(4, "K4ABC", 14280), rawSpot(5, "K2ABC", 14265)))
+    assert rotation.current.frequency == 14265000
+    assert rotation.peek().activator == "K3ABC"
+    assert activators(rotation, 4) == ["K3ABC", "K4ABC", "K2ABC", "K1ABC"]
+
+
+def testRespotWhileNextSpotGoesAway():
+    rotation = ScanRotation(order=ScanOrder.FEED)
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 14260),
+                            rawSpot(3, "K3ABC", 14270), rawSpot(4, "K4ABC", 14280)))
+    assert activators(rotation, 1) == ["K1ABC"]
+    rotation.update(spotsOf(rawSpot(2, "K2ABC", 14260), rawSpot(3, "K3ABC", 14270),
+                            rawSpot(4, "K4ABC", 14280), rawSpot(5, "K1ABC", 14255)))
+    # Then the one we were going to next goes QRT
+    rotation.update(spotsOf(rawSpot(3, "K3ABC", 14270), rawSpot(4, "K4ABC", 14280),
+                            rawSpot(5, "K1ABC", 14255)))
+    assert rotation.current.activator == "K1ABC"
+    assert activators(rotation, 3) == ["K3ABC", "K4ABC", "K1ABC"]
+
+
+def testNewSpotAfterOursIsntSkipped():
+    rotation = ScanRotation(order=ScanOrder.FREQUENCY)
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 14270)))
+    assert activators(rotation, 1) == ["K1ABC"]
+    rotation.update(spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 14270),
+                            rawSpot(3, "K3ABC", 14260)))
+    assert activators(rotation, 3) == ["K3ABC", "K2ABC", "K1ABC"]
+
+
+class FakeClock():
+    """A monotonic clock that only moves when it's told to"""
+
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+# In a ScriptedInbox script: the machine sleeps for this many seconds
+Sleep = collections.namedtuple("Sleep", ["seconds"])
+
+
+class ScriptedInbox():
+    """
+    Stands in for ScanEngine.inbox, so run() goes by a FakeClock: time passes
+    while it waits on the inbox, and the items in script, a list of (when,
+    item) tuples, turn up at their times.
+    """
+
+    def __init__(self, clock, script=()) -> None:
+        self.clock = clock
+        self.script = sorted(script, key=lambda entry: entry[0])
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        with self.lock:
+            self.script.insert(0, (self.clock.now, item))
+
+    def get(self, timeout):
+        with self.lock:
+            if self.script and self.script[0][0] <= self.clock.now + timeout:
+                when, item = self.script.pop(0)
+                self.clock.now = max(self.clock.now, when)
+                if isinstance(item, Sleep):
+                    self.clock.now += item.seconds
+                    return None
+                return item
+            self.clock.now += timeout
+        raise queue.Empty
+
+
+def fetched(*raw_spots):
+    """A finished refresh, as ScanEngine.spotsFetched gets it"""
+    future = concurrent.futures.Future()
+    future.set_result(pota.ingestSpots(raw_spots))
+    return future
+
+
+def waitFor(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def fake_rig():
+    connected = threading.Event()
+    rig = CATWorker("fake", "127.0.0.1", 0, on_connect=lambda online: connected.set())
+    connected.wait()
+    yield rig
+    rig.stop()
+
+
+SPOTS = [rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 7030, "CW"),
+         rawSpot(3, "K3ABC", 14030, "CW"), rawSpot(4, "K4ABC", 7200)]
+
+
+def scanWith(fake_rig, tmp_path, script=(), count=5, **kw):
+    """Runs a ScanEngine on SPOTS for count tunes, returning (time, activator, frequency) for each"""
+    controller = pota.PotaSpotController(cache_dir=str(tmp_path))
+    controller.setSpots(pota.ingestSpots(SPOTS))
+    tunes = []
+    clock = FakeClock()
+    engine = ScanEngine(controller, [fake_rig], interval=10, clock=clock,
+                        on_tune=lambda number, spot: tunes.append(
+                            (clock.now, spot.activator, spot.frequency)), **kw)
+    engine.inbox = ScriptedInbox(clock, script)
+    engine.run(max_tunes=count)
+    return tunes
+
+
+def testEngineTunesUpThroughTheFrequencies(fake_rig, tmp_path):
+    tunes = scanWith(fake_rig, tmp_path)
+    assert [activator for _, activator, _ in tunes] == ["K2ABC", "K4ABC", "K3ABC", "K1ABC", "K2ABC"]
+    assert [when for when, _, _ in tunes] == [0, 10, 20, 30, 40]
+    # And the rig went there
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo"] == "7030000")
+
+
+def testEngineFeedOrder(fake_rig, tmp_path):
+    tunes = scanWith(fake_rig, tmp_path, count=4, order=ScanOrder.FEED)
+    assert [activator for _, activator, _ in tunes] == ["K1ABC", "K2ABC", "K3ABC", "K4ABC"]
+
+
+def testEngineFollowsAnActivatorWhoMoves(fake_rig, tmp_path):
+    # K4ABC (on from 10) moves up to 7.250 at 15
+    moved = fetched(*SPOTS[:3], rawSpot(5, "K4ABC", 7250))
+    tunes = scanWith(fake_rig, tmp_path, script=[(15, moved)], count=4)
+    assert tunes == [(0, "K2ABC", 7030000), (10, "K4ABC", 7200000), (15, "K4ABC", 7250000),
+                     (20, "K3ABC", 14030000)]
+    # Following them doesn't put the hops off
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo"] == "14030000")
+
+
+def testEngineStartsCountingAgainAfterFallingBehind(fake_rig, tmp_path):
+    # The machine sleeps for half a minute at 25
+    tunes = scanWith(fake_rig, tmp_path, script=[(25, Sleep(32))])
+    assert [when for when, _, _ in tunes] == [0, 10, 20, 57, 67]
+    # No hops were made up for
+    assert [activator for _, activator, _ in tunes] == ["K2ABC", "K4ABC", "K3ABC", "K1ABC", "K2ABC"]
+
+
+def testMainScansSavedSpots(tmp_path, capsys):
+    spots = tmp_path / "spots.json"
+    spots.write_text(json.dumps(SPOTS))
+    assert scan.main(["--fake", "--spots", str(spots), "--count", "3", "--interval", "0.01",
+                      "--band", "40"]) == 0
+    tunes = [line.split() for line in capsys.readouterr().out.splitlines()]
+    assert [(tune[1], tune[3], tune[5]) for tune in tunes] == [
+        ("TUNE", "K2ABC", "7030.0"), ("TUNE", "K4ABC", "7200.0"), ("TUNE", "K2ABC", "7030.0")]
+
+
+class InlineRig():
+    """
+    A fake CAT rig behind CATWorker's interface, that does everything straight
+    away on the calling thread - so S-meter readings reach the engine at a
+    known time
+    """
+
+    def __init__(self) -> None:
+        self.rig = CAT("fake", "127.0.0.1", 0)
+        self.online = True
+
+    def submit(self, method, *args, callback=None):
+        if isinstance(method, str):
+            method = getattr(self.rig, method)
+        result = method(*args)
+        if callback is not None:
+            callback(result)
+
+    def tune(self, freq, mode):
+        self.rig.batch([("set_vfo", freq), ("set_mode", mode)])
+
+
+def testDwellVerdicts():
+    rig = CAT("fake", "127.0.0.1", 0)
+    rig.fake_radio["signals"]["14250000"] = 10
+    dwell = AdaptiveDwell(listen_time=1.5)
+    quiet, busy = spotsOf(rawSpot(1, "K1ABC", 14030, "CW"), rawSpot(2, "K2ABC", 14250))
+    assert dwell.verdict(quiet, [], 0.25) is Dwell.LISTEN
+
+    rig.set_vfo(quiet.frequency)
+    readings = [rig.get_strength()]
+    assert dwell.verdict(quiet, readings, 0.25) is Dwell.LISTEN
+    readings.append(rig.get_strength())
+    assert dwell.verdict(quiet, readings, 1.5) is Dwell.MOVE_ON
+
+    rig.set_vfo(busy.frequency)
+    assert dwell.verdict(busy, [rig.get_strength()], 0.25) is Dwell.HOLD
+    # No S-meter: we can't tell, so we stay
+    assert dwell.verdict(quiet, [None, None], 1.5) is Dwell.HOLD
+
+
+def testDwellLearnsTheNoiseFloor():
+    dwell = AdaptiveDwell(listen_time=1.5, threshold=-36, margin=10)
+    spot = spotsOf(rawSpot(1, "K1ABC", 7030, "CW"))[0]
+    # A noisy band: -33 is over the threshold, so someone's there
+    assert dwell.verdict(spot, [-33], 0.25) is Dwell.HOLD
+    # Until quiet spots show the band is that noisy
+    assert dwell.verdict(spot, [-40, -41, -40], 1.5) is Dwell.MOVE_ON
+    assert dwell.noise_floor == {spot.band: -40}
+    assert dwell.thresholdFor(spot.band) == -30
+    assert dwell.verdict(spot, [-33], 1.5) is Dwell.MOVE_ON
+    assert dwell.noise_floor[spot.band] == -40 + AdaptiveDwell.FLOOR_WEIGHT * 7
+    # Other bands keep the plain threshold
+    assert dwell.thresholdFor(pota.Band.METERS_20) == -36
+
+
+def adaptiveEngine(tmp_path, rig, script=()):
+    controller = pota.PotaSpotController(cache_dir=str(tmp_path))
+    controller.setSpots(pota.ingestSpots(SPOTS))
+    clock = FakeClock()
+    tunes = []
+    engine = ScanEngine(controller, [rig], interval=10, clock=clock,
+                        dwell=AdaptiveDwell(listen_time=1.5, sample_interval=0.25),
+                        on_tune=lambda number, spot: tunes.append((clock.now, spot.activator)))
+    engine.inbox = ScriptedInbox(clock, script)
+    return engine, tunes
+
+
+def testEngineMovesOnFromQuietSpots(tmp_path):
+    rig = InlineRig()
+    rig.rig.fake_radio["signals"]["7200000"] = 10
+    engine, tunes = adaptiveEngine(tmp_path, rig)
+    engine.run(max_tunes=5)
+    # Only K4ABC is on the air, so it's the only one that gets the whole interval
+    assert tunes == [(0, "K2ABC"), (1.5, "K4ABC"), (11.5, "K3ABC"), (13, "K1ABC"), (14.5, "K2ABC")]
+    assert set(engine.dwell.noise_floor) == {pota.Band.METERS_40, pota.Band.METERS_20}
+
+
+def testEngineIgnoresLateReadings(tmp_path):
+    rig = InlineRig()
+    engine, tunes = adaptiveEngine(tmp_path, rig)
+    engine.refilter()
+    engine.hop(0)
+    engine.hop(0)
+    engine.clock.now = 5
+    # A strong reading from the first spot, turning up after we've moved on
+    engine.handleReading(Reading(0, 1, 20))
+    assert engine.readings[0] == []
+    # The quiet spot we're on now is still moved on from
+    engine.handleReading(Reading(0, 2, -54))
+    assert engine.next_hop[0] == 5
+    assert [activator for _, activator in tunes] == ["K2ABC", "K4ABC"]
+
+
+def testDualVfoHopsBySwapping(fake_rig):
+    tuner = RigTuner(fake_rig, dual_vfo=True)
+    first, second, third = spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 7200),
+                                   rawSpot(3, "K3ABC", 7250))
+    swaps = []
+    swap_vfo = fake_rig.rig.swap_vfo
+    fake_rig.rig.swap_vfo = lambda: swaps.append(True) or swap_vfo()
+    assert tuner.tune(first, second)
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo_b"] == "7200000")
+    assert tuner.tune(second, third)
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo"] == "7200000")
+    assert swaps == [True]
+    assert fake_rig.rig.fake_radio["mode"] == "LSB"
+
+
+def testFailedPretuneFallsBackToATune(fake_rig):
+    tuner = RigTuner(fake_rig, dual_vfo=True)
+    first, second, third = spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 7200),
+                                   rawSpot(3, "K3ABC", 7250))
+    fake_rig.rig.preset_vfo_b = lambda freq, mode: False
+    assert tuner.tune(first, second)
+    # The next hop won't count on VFO B
+    waitFor(lambda: tuner.preset is None)
+    # Even if it swaps anyway, the rig gets there
+    tuner.preset = second
+    assert tuner.tune(second, third)
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo"] == "7200000")
+    assert fake_rig.rig.fake_radio["mode"] == "LSB"
+
+
+def testFailedSwapFallsBackToATune(fake_rig):
+    tuner = RigTuner(fake_rig, dual_vfo=True)
+    first, second, third = spotsOf(rawSpot(1, "K1ABC", 14250), rawSpot(2, "K2ABC", 7200),
+                                   rawSpot(3, "K3ABC", 7250))
+    fake_rig.rig.swap_vfo = lambda: False
+    assert tuner.tune(first, second)
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo_b"] == "7200000")
+    assert tuner.preset == second
+    assert tuner.tune(second, third)
+    waitFor(lambda: fake_rig.rig.fake_radio["vfo"] == "7200000")